@@ -16,6 +16,12 @@ start_updater () {
   python3 updater.py
 }
 
+start_maintenance () {
+  echo "Start Maintenance"
+
+  python3 maintenance.py "$@"
+}
+
 unknown () {
   echo "Invalid Component"
 }
@@ -27,6 +33,9 @@ case "$component" in
     updater)
         start_updater
         ;;
+    maintenance)
+        start_maintenance "${@:2}"
+        ;;
     *)
         unknown
         ;;
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+from argparse import ArgumentParser
+from os import path
+
+from src.util.config import Config
+from src.util.log import Log
+from src.db.database import Database
+from src.db.entity import User, DailyTotal, HeatmapCounter
+import version
+
+
+def rebuild_daily_totals(logger) -> None:
+    for user in User.objects():
+        for user_workspace in user.workspaces:
+            count = DailyTotal.rebuild(user, user_workspace.workspace)
+            logger.info(
+                "Rebuilt %i daily totals of user %i in workspace %i",
+                count,
+                user.user_id,
+                user_workspace.workspace.workspace_id,
+            )
+        user.save()
+
+
+def rebuild_heatmaps(logger) -> None:
+    for user in User.objects():
+        for user_workspace in user.workspaces:
+            HeatmapCounter.rebuild(user, user_workspace.workspace)
+            logger.info(
+                "Rebuilt heatmap of user %i in workspace %i",
+                user.user_id,
+                user_workspace.workspace.workspace_id,
+            )
+
+
+def main():
+    parser = ArgumentParser(description="Maintenance tasks")
+    parser.add_argument("task", choices=["rebuild-daily-totals", "rebuild-heatmaps"])
+    args = parser.parse_args()
+
+    Log.init()
+    logger = Log.get_logger("root")
+    logger.info("Start maintenance @%s (%s)", version.VERSION, version.COMMIT)
+
+    script_dir = path.dirname(path.realpath(__file__))
+    config = Config(path.join(script_dir, ".env"))
+    logger.setLevel(config.log_level)
+    Database.connect(config.database_uri)
+    Database.ensure_indexes()
+
+    if args.task == "rebuild-daily-totals":
+        rebuild_daily_totals(logger)
+    elif args.task == "rebuild-heatmaps":
+        rebuild_heatmaps(logger)
+
+    Database.disconnect()
+    logger.info("Exit maintenance")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+from src.db.entity import User, Workspace, Schedule, Event
+from src.schedule import (
+    Day,
+    DayAggregate,
+    All,
+    Report,
+    Resolver,
+    CumulativeTotals,
+)
+
+
+class ColumnarDay:
+    """
+    View on a single day of a ColumnarReport with the same interface as Day.
+    """
+
+    def __init__(self, report: "ColumnarReport", index: int, day_date: date):
+        self.report = report
+        self.index = index
+        self.date = day_date
+
+    @property
+    def events(self) -> list[Event]:
+        return self.report.events.get(self.index, [])
+
+    def get_id(self) -> int:
+        return Day.get_id_by_day(self.date)
+
+    def target_time(self) -> int:
+        return int(self.report.target_time[self.index])
+
+    def actual_time(self) -> int:
+        return int(self.report.actual_time[self.index])
+
+    def time_entry_count(self) -> int:
+        return int(self.report.time_entry_count[self.index])
+
+    def delta(self) -> int:
+        return self.actual_time() - self.target_time()
+
+    def delta_percentage(self) -> float:
+        if self.target_time() > 0:
+            return self.delta() / self.target_time() * 100
+        else:
+            return None
+
+
+class ColumnarAggregate:
+    """
+    Precomputed totals of a week, month, quarter, year or the whole report
+    with the same interface as DayAggregate.
+    """
+
+    def __init__(self, period: DayAggregate, days: list[ColumnarDay], totals: tuple):
+        self.period = period
+        self.start = period.start
+        self.end = period.end
+        self.max_days = period.max_days
+        self.days = days
+        for name in ("year", "quarter", "month", "week"):
+            if hasattr(period, name):
+                setattr(self, name, getattr(period, name))
+        (
+            self.__target_time,
+            self.__actual_time,
+            self.__days_with_target_time,
+            self.__days_with_actual_time,
+        ) = map(int, totals)
+
+    def days_with_target_time(self) -> int:
+        return self.__days_with_target_time
+
+    def days_with_actual_time(self) -> int:
+        return self.__days_with_actual_time
+
+    def target_time(self) -> int:
+        return self.__target_time
+
+    def actual_time(self) -> int:
+        return self.__actual_time
+
+    def delta(self) -> int:
+        return self.actual_time() - self.target_time()
+
+
+class ColumnarReport:
+    """
+    Report that keeps all values as numpy arrays indexed by the day offset
+    from the start date instead of one object per day.
+    """
+
+    def __init__(
+        self,
+        user: User,
+        workspace: Workspace,
+        start_date: date,
+        end_date: date,
+    ) -> None:
+        self.user = user
+        self.workspace = workspace
+        self.start_date = start_date
+        self.end_date = end_date
+
+        day_count = max((end_date - start_date).days + 1, 0)
+        self.target_base = np.zeros(day_count, dtype=np.float64)
+        self.mod_relative = np.zeros(day_count, dtype=np.float64)
+        self.mod_absolute = np.zeros(day_count, dtype=np.float64)
+        self.actual_time = np.zeros(day_count, dtype=np.int64)
+        self.time_entry_count = np.zeros(day_count, dtype=np.int64)
+        self.target_time = np.zeros(day_count, dtype=np.int64)
+        self.events = {}
+
+        self.days = {}
+        self.day_list = []
+        self.cumulative = None
+        self.__aggregates = {}
+        self.__all = None
+
+    @property
+    def weeks(self) -> dict[tuple, ColumnarAggregate]:
+        return self.get_aggregates("week")
+
+    @property
+    def months(self) -> dict[tuple, ColumnarAggregate]:
+        return self.get_aggregates("month")
+
+    @property
+    def quarters(self) -> dict[tuple, ColumnarAggregate]:
+        return self.get_aggregates("quarter")
+
+    @property
+    def years(self) -> dict[int, ColumnarAggregate]:
+        return self.get_aggregates("year")
+
+    @property
+    def all(self) -> ColumnarAggregate:
+        if self.__all is None:
+            self.__all = ColumnarAggregate(
+                All(self.start_date, self.end_date),
+                self.day_list,
+                [column.sum() for column in self.__get_columns()],
+            )
+
+        return self.__all
+
+    def get_aggregates(self, granularity: str) -> dict:
+        """
+        Returns the aggregates of a granularity (see Report.GRANULARITIES) by
+        key. They are built on first access.
+        """
+        if granularity not in Report.GRANULARITIES:
+            raise ValueError(f"Unknown granularity {granularity}")
+
+        if granularity not in self.__aggregates:
+            self.__aggregates[granularity] = self.__aggregate(
+                Report.GRANULARITIES[granularity]
+            )
+
+        return self.__aggregates[granularity]
+
+    def running_delta(self) -> int:
+        return int(self.actual_time.sum() - self.target_time.sum())
+
+    def balance(self, start_date: date, end_date: date) -> int:
+        return self.cumulative.balance(start_date, end_date)
+
+    def running_balance(self, day_date: date) -> int:
+        return self.cumulative.running_balance(day_date)
+
+    def __get_columns(self) -> tuple:
+        return (
+            self.target_time,
+            self.actual_time,
+            (self.target_time > 0).astype(np.int64),
+            (self.actual_time > 0).astype(np.int64),
+        )
+
+    def __aggregate(self, aggregate_cls: type) -> dict:
+        if len(self.day_list) == 0:
+            return {}
+
+        keys = [aggregate_cls.get_key_from_date(day.date) for day in self.day_list]
+        starts = [i for i in range(len(keys)) if i == 0 or keys[i] != keys[i - 1]]
+        ends = starts[1:] + [len(keys)]
+        totals = [np.add.reduceat(column, starts) for column in self.__get_columns()]
+
+        result = {}
+        for group, (start, end) in enumerate(zip(starts, ends)):
+            result[keys[start]] = ColumnarAggregate(
+                aggregate_cls.from_key(keys[start]),
+                self.day_list[start:end],
+                [total[group] for total in totals],
+            )
+
+        return result
+
+
+class ColumnarResolver:
+    @classmethod
+    def create_report(
+        cls,
+        user: User,
+        workspace: Workspace,
+        start_date: date,
+        end_date: date,
+        engine: str = Resolver.ENGINE_AGGREGATION,
+    ) -> ColumnarReport:
+        report = ColumnarReport(user, workspace, start_date, end_date)
+        day_count = len(report.target_time)
+        start_ordinal = start_date.toordinal()
+
+        # process schedules
+        schedules = Schedule.objects(user=user, workspace=workspace)
+        for schedule in schedules:
+            indices = cls.__get_indices(schedule, start_date, end_date, day_count)
+            report.target_base[indices] += schedule.target
+
+        # process events
+        events = Event.objects(user=user, workspace=workspace)
+        for event in events:
+            indices = cls.__get_indices(event, start_date, end_date, day_count)
+            report.mod_relative[indices] += event.mod_relative
+            report.mod_absolute[indices] += event.mod_absolute
+            for index in indices.tolist():
+                report.events.setdefault(index, []).append(event)
+
+        report.target_time = np.trunc(
+            report.target_base * (1 + report.mod_relative) + report.mod_absolute
+        ).astype(np.int64)
+
+        # process time entries
+        rows = [
+            (day_key - start_ordinal, *values)
+            for day_key, *values in Resolver.iter_tracked_time(
+                user, workspace, start_date, end_date, engine
+            )
+        ]
+        if len(rows) > 0:
+            indices, actual_times, time_entry_counts = map(np.array, zip(*rows))
+            in_range = (indices >= 0) & (indices < day_count)
+            np.add.at(report.actual_time, indices[in_range], actual_times[in_range])
+            np.add.at(
+                report.time_entry_count, indices[in_range], time_entry_counts[in_range]
+            )
+
+        # create day views, weeks, months, ... are aggregated on demand
+        report.day_list = [
+            ColumnarDay(report, index, start_date + timedelta(days=index))
+            for index in range(day_count)
+        ]
+        report.days = {day.get_id(): day for day in report.day_list}
+
+        report.cumulative = CumulativeTotals(
+            start_date, report.target_time.tolist(), report.actual_time.tolist()
+        )
+
+        return report
+
+    @classmethod
+    def __get_indices(
+        cls, document: Schedule | Event, start_date: date, end_date: date, count: int
+    ):
+        indices = np.array(
+            [
+                apply_date.toordinal() - start_date.toordinal()
+                for apply_date in Resolver.get_apply_dates(
+                    document, start_date, end_date
+                )
+            ],
+            dtype=np.int64,
+        )
+        # a day only counts a schedule or event once
+        return np.unique(indices[(indices >= 0) & (indices < count)])
@@ -3,6 +3,8 @@ from mongoengine import connect, disconnect
 from mongoengine.connection import get_db
 from urllib.parse import urlparse
 
+from src.db.entity import BaseDocument
+
 
 class Database:
     @staticmethod
@@ -33,6 +35,14 @@ class Database:
             status["version"],
         )
 
+    @staticmethod
+    def ensure_indexes():
+        documents = BaseDocument.__subclasses__()
+        for document in documents:
+            document.ensure_indexes()
+
+        logging.debug("Ensured indexes of %i collections", len(documents))
+
     @staticmethod
     def disconnect():
         disconnect()
@@ -1,8 +1,15 @@
-from datetime import datetime, timezone, timedelta, date
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta, date, time
 from bson import DBRef
 from typing import Any
+import hashlib
+import json
+import logging
+import math
 import secrets
 
+from pymongo import DeleteOne, UpdateOne
+
 from mongoengine import (
     Document,
     BooleanField,
@@ -18,6 +25,9 @@ from mongoengine import (
     StringField,
 )
 
+from src.db.reference_cache import ReferenceCache
+from src.util.timezone_table import TimezoneTable
+from src.util.week_minutes import WeekMinutes
 from src.toggl.model.me import MeData
 from src.toggl.model import (
     WorkspaceData,
@@ -32,6 +42,8 @@ from src.toggl.model import (
 
 class BaseDocument(Document):
     COLLECTION_NAME = ""
+    # Raw fields of existing documents that are passed to after_bulk_upsert
+    TRACKED_FIELDS = ()
 
     @classmethod
     def to_dbref_pk(cls, primary_key: Any | None):
@@ -47,7 +59,124 @@ class BaseDocument(Document):
             else None
         )
 
-    meta = {"abstract": True}
+    @classmethod
+    def bulk_upsert(cls, rows: list[tuple[Any, dict, dict]]) -> tuple[int, int]:
+        """
+        Upserts raw documents with a single unordered bulk write. Each row
+        consists of the primary key, the fields to set and the fields that are
+        only set when the document is created. Documents whose content hash
+        did not change are not rewritten, only their fetched_at is bumped.
+        Returns (created, updated).
+        """
+        if len(rows) == 0:
+            return 0, 0
+
+        collection = cls._get_collection()
+        fetched_at = datetime.now(timezone.utc)
+        projection = {"content_hash": 1, **{f: 1 for f in cls.TRACKED_FIELDS}}
+        existing_documents = {
+            document["_id"]: document
+            for document in collection.find(
+                {"_id": {"$in": [row[0] for row in rows]}}, projection
+            )
+        }
+
+        requests = []
+        changed_rows = []
+        unchanged_primary_keys = []
+        for primary_key, set_fields, insert_fields in rows:
+            content_hash = cls.compute_content_hash(set_fields, insert_fields)
+            existing_document = existing_documents.get(primary_key, {})
+            if existing_document.get("content_hash", False) == content_hash:
+                unchanged_primary_keys.append(primary_key)
+                continue
+
+            update = {
+                "$set": {
+                    **set_fields,
+                    "fetched_at": fetched_at,
+                    "content_hash": content_hash,
+                }
+            }
+            if len(insert_fields) > 0:
+                update["$setOnInsert"] = insert_fields
+            requests.append(UpdateOne({"_id": primary_key}, update, upsert=True))
+            changed_rows.append((primary_key, set_fields, insert_fields))
+
+        if len(unchanged_primary_keys) > 0:
+            collection.update_many(
+                {"_id": {"$in": unchanged_primary_keys}},
+                {"$set": {"fetched_at": fetched_at}},
+            )
+
+        if len(requests) == 0:
+            return 0, 0
+
+        result = collection.bulk_write(requests, ordered=False)
+        ReferenceCache.invalidate(cls, [row[0] for row in changed_rows])
+        cls.after_bulk_upsert(changed_rows, existing_documents)
+
+        return result.upserted_count, result.matched_count
+
+    @classmethod
+    def after_bulk_upsert(
+        cls, changed_rows: list[tuple[Any, dict, dict]], previous_documents: dict
+    ) -> None:
+        """
+        Called with the rows that were written by bulk_upsert and the
+        TRACKED_FIELDS of the documents as they were before the write.
+        """
+
+    @classmethod
+    def compute_content_hash(cls, set_fields: dict, insert_fields: dict) -> str:
+        content = json.dumps(
+            [set_fields, insert_fields],
+            sort_keys=True,
+            default=lambda v: (
+                v.astimezone(timezone.utc).isoformat()
+                if isinstance(v, datetime)
+                else str(v)
+            ),
+        )
+
+        return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+    @classmethod
+    def bulk_delete(cls, primary_keys: set) -> int:
+        """
+        Deletes all documents with the given primary keys server-side.
+        Returns the number of deleted documents.
+        """
+        if len(primary_keys) == 0:
+            return 0
+
+        result = cls._get_collection().delete_many({"_id": {"$in": list(primary_keys)}})
+        ReferenceCache.invalidate(cls, primary_keys)
+
+        return result.deleted_count
+
+    @classmethod
+    def bulk_unlink(cls, db_field: str, primary_keys: set) -> int:
+        """
+        Sets the reference stored in db_field to null for all documents that
+        reference one of the given primary keys. Returns the number of
+        modified documents.
+        """
+        if len(primary_keys) == 0:
+            return 0
+
+        # the content hash no longer matches, so the next upsert restores the
+        # reference if it is still set remotely
+        result = cls._get_collection().update_many(
+            {db_field: {"$in": list(primary_keys)}},
+            {"$set": {db_field: None, "content_hash": None}},
+        )
+        ReferenceCache.invalidate(cls)
+
+        return result.modified_count
+
+    # Indexes are created once on startup by Database.ensure_indexes
+    meta = {"abstract": True, "auto_create_index": False}
 
 
 class Organization(BaseDocument):
@@ -55,6 +184,7 @@ class Organization(BaseDocument):
 
     organization_id = IntField(primary_key=True, required=True)
     fetched_at = DateTimeField(required=True)
+    content_hash = StringField()
     name = StringField(required=True)
 
     meta = {"collection": COLLECTION_NAME}
@@ -62,24 +192,28 @@ class Organization(BaseDocument):
     @classmethod
     def create_or_update_via_api_data(
         cls, organization_data: OrganizationData
-    ) -> "Organization":
-        try:
-            organization = Organization.objects.get(
-                organization_id=organization_data.id
-            )
-        except DoesNotExist:
-            organization = Organization(organization_id=organization_data.id)
+    ) -> tuple[int, int]:
+        return cls.bulk_create_or_update_via_api_data([organization_data])
 
-        organization.fetched_at = datetime.now(timezone.utc)
-        organization.name = organization_data.name
+    @classmethod
+    def bulk_create_or_update_via_api_data(
+        cls, organization_dataset: list[OrganizationData]
+    ) -> tuple[int, int]:
+        return cls.bulk_upsert(list(map(cls.api_data_to_mongo, organization_dataset)))
 
-        return organization.save()
+    @classmethod
+    def api_data_to_mongo(cls, organization_data: OrganizationData) -> tuple:
+        return (
+            organization_data.id,
+            {
+                "name": organization_data.name,
+            },
+            {},
+        )
 
     @classmethod
-    def delete_via_ids(cls, organization_ids: set) -> None:
-        organizations = Organization.objects(organization_id__in=organization_ids)
-        for organization in organizations:
-            organization.delete()
+    def delete_via_ids(cls, organization_ids: set) -> int:
+        return cls.bulk_delete(organization_ids)
 
 
 class Workspace(BaseDocument):
@@ -90,44 +224,111 @@ class Workspace(BaseDocument):
         Organization, db_field="organization_id", required=True
     )
     fetched_at = DateTimeField(required=True)
+    content_hash = StringField()
     name = StringField(required=True)
     logo_url = StringField()
+    # Upper bound of the duration of all stopped time entries in seconds,
+    # None while unknown (workspaces stored before it was tracked)
+    max_time_entry_duration = IntField()
 
     meta = {"collection": COLLECTION_NAME}
 
     @classmethod
     def create_or_update_via_api_data(
         cls, workspace_data: WorkspaceData
-    ) -> "Workspace":
-        try:
-            workspace = Workspace.objects.get(
-                workspace_id=workspace_data.id,
-            )
-        except DoesNotExist:
-            workspace = Workspace(
-                workspace_id=workspace_data.id,
-                organization=Organization.to_dbref_pk(workspace_data.organization_id),
-            )
+    ) -> tuple[int, int]:
+        return cls.bulk_create_or_update_via_api_data([workspace_data])
+
+    @classmethod
+    def bulk_create_or_update_via_api_data(
+        cls, workspace_dataset: list[WorkspaceData]
+    ) -> tuple[int, int]:
+        return cls.bulk_upsert(list(map(cls.api_data_to_mongo, workspace_dataset)))
+
+    @classmethod
+    def api_data_to_mongo(cls, workspace_data: WorkspaceData) -> tuple:
+        return (
+            workspace_data.id,
+            {
+                "name": workspace_data.name,
+                "logo_url": workspace_data.logo_url,
+            },
+            {
+                "organization_id": workspace_data.organization_id,
+                # a new workspace has no time entries yet
+                "max_time_entry_duration": 0,
+            },
+        )
 
-        workspace.fetched_at = datetime.now(timezone.utc)
-        workspace.name = workspace_data.name
-        workspace.logo_url = workspace_data.logo_url
+    @classmethod
+    def delete_via_ids(cls, workspace_ids: set) -> int:
+        return cls.bulk_delete(workspace_ids)
 
-        return workspace.save()
+    @classmethod
+    def raise_max_time_entry_durations(cls, durations: dict[int, int]) -> None:
+        """
+        Raises the known maximum time entry durations of the given workspaces.
+        Unknown maximums stay unknown until they are rebuilt.
+        """
+        requests = [
+            UpdateOne(
+                {"_id": workspace_id, "max_time_entry_duration": {"$ne": None}},
+                {"$max": {"max_time_entry_duration": duration}},
+            )
+            for workspace_id, duration in durations.items()
+        ]
+        if len(requests) > 0:
+            cls._get_collection().bulk_write(requests, ordered=False)
+            ReferenceCache.invalidate(cls, durations.keys())
 
     @classmethod
-    def delete_via_ids(cls, workspace_ids: set) -> None:
-        workspaces = Workspace.objects(workspace_id__in=workspace_ids)
-        for workspace in workspaces:
-            workspace.delete()
+    def rebuild_max_time_entry_duration(cls, workspace_id: int) -> int:
+        result = list(
+            TimeEntry._get_collection().aggregate(
+                [
+                    {
+                        "$match": {
+                            "workspace_id": workspace_id,
+                            "stopped_at": {"$ne": None},
+                        }
+                    },
+                    {
+                        "$group": {
+                            "_id": None,
+                            "duration": {
+                                "$max": {"$subtract": ["$stopped_at", "$started_at"]}
+                            },
+                        }
+                    },
+                ]
+            )
+        )
+        # milliseconds, rounded up to full seconds
+        duration = math.ceil(result[0]["duration"] / 1000) if len(result) > 0 else 0
+
+        cls._get_collection().update_one(
+            {"_id": workspace_id}, {"$set": {"max_time_entry_duration": duration}}
+        )
+        ReferenceCache.invalidate(cls, [workspace_id])
+
+        return duration
 
 
 class UserWorkspace(EmbeddedDocument):
     workspace = ReferenceField(Workspace, db_field="workspace_id", required=True)
     schedule_calendar_url = StringField()
+    # Validators and body hash of the last processed schedule calendar
+    schedule_calendar_etag = StringField()
+    schedule_calendar_last_modified = StringField()
+    schedule_calendar_hash = StringField()
     start_of_aggregation = DateField(required=True)
     subscription_token = StringField()
     last_webhook_event_received_at = DateTimeField()
+    time_entries_synced_at = DateTimeField()
+    time_entries_full_synced_at = DateTimeField()
+    daily_totals_timezone = StringField()
+    # Increased after every change of the data that reports are built from
+    data_version = IntField(default=0)
 
 
 class User(BaseDocument):
@@ -147,7 +348,23 @@ class User(BaseDocument):
     api_token = StringField(required=True)
     timezone = StringField(required=True)
 
-    meta = {"collection": COLLECTION_NAME}
+    meta = {
+        "collection": COLLECTION_NAME,
+        "indexes": ["next_toggl_sync_at", "next_calendar_sync_at"],
+    }
+
+    @classmethod
+    def bump_data_version(cls, workspace_id: int, user_id: int = None) -> None:
+        """
+        Increases the data version of a workspace, either for a single user or
+        for all users of the workspace.
+        """
+        query = {"workspaces.workspace_id": workspace_id}
+        if user_id is not None:
+            query["_id"] = user_id
+        cls._get_collection().update_many(
+            query, {"$inc": {"workspaces.$.data_version": 1}}
+        )
 
     @classmethod
     def create_or_update_via_api_data(
@@ -215,41 +432,46 @@ class Client(BaseDocument):
     client_id = IntField(primary_key=True, required=True)
     workspace = ReferenceField(Workspace, db_field="workspace_id", required=True)
     fetched_at = DateTimeField(required=True)
+    content_hash = StringField()
     name = StringField(required=True)
     archived = BooleanField(required=True)
 
-    meta = {"collection": COLLECTION_NAME}
+    meta = {"collection": COLLECTION_NAME, "indexes": ["workspace"]}
 
     @classmethod
-    def create_or_update_via_api_data(cls, client_data: ClientData) -> "Client":
-        try:
-            client = Client.objects.get(client_id=client_data.id)
-        except DoesNotExist:
-            client = Client(
-                client_id=client_data.id,
-                workspace=Workspace.to_dbref_pk(client_data.wid),
-            )
-
-        client.fetched_at = datetime.now(timezone.utc)
-        client.name = client_data.name
-        client.archived = client_data.archived
+    def create_or_update_via_api_data(cls, client_data: ClientData) -> tuple[int, int]:
+        return cls.bulk_create_or_update_via_api_data([client_data])
 
-        return client.save()
+    @classmethod
+    def bulk_create_or_update_via_api_data(
+        cls, client_dataset: list[ClientData]
+    ) -> tuple[int, int]:
+        return cls.bulk_upsert(list(map(cls.api_data_to_mongo, client_dataset)))
 
     @classmethod
-    def delete_via_ids(cls, client_ids: set) -> None:
-        clients = Client.objects(client_id__in=client_ids)
+    def api_data_to_mongo(cls, client_data: ClientData) -> tuple:
+        return (
+            client_data.id,
+            {
+                "name": client_data.name,
+                "archived": client_data.archived,
+            },
+            {"workspace_id": client_data.wid},
+        )
 
-        for project in Project.objects(client__in=clients):
-            project.client = None
-            project.save()
+    @classmethod
+    def delete_via_ids(cls, client_ids: set) -> int:
+        projects_unlinked = Project.bulk_unlink("client_id", client_ids)
+        if projects_unlinked > 0:
+            logging.info(
+                "Projects unlinked from deleted clients: %i", projects_unlinked
+            )
 
-        for client in clients:
-            client.delete()
+        return cls.bulk_delete(client_ids)
 
     @classmethod
-    def delete_via_id(cls, client_id: int) -> None:
-        cls.delete_via_ids((client_id,))
+    def delete_via_id(cls, client_id: int) -> int:
+        return cls.delete_via_ids((client_id,))
 
 
 class Project(BaseDocument):
@@ -259,42 +481,49 @@ class Project(BaseDocument):
     workspace = ReferenceField(Workspace, db_field="workspace_id", required=True)
     client = ReferenceField(Client, db_field="client_id")
     fetched_at = DateTimeField(required=True)
+    content_hash = StringField()
     name = StringField(required=True)
     color = StringField()
 
-    meta = {"collection": COLLECTION_NAME}
+    meta = {"collection": COLLECTION_NAME, "indexes": ["workspace", "client"]}
 
     @classmethod
-    def create_or_update_via_api_data(cls, project_data: ProjectData) -> "Project":
-        try:
-            project = Project.objects.get(project_id=project_data.id)
-        except DoesNotExist:
-            project = Project(
-                project_id=project_data.id,
-                workspace=Workspace.to_dbref_pk(project_data.workspace_id),
-            )
-
-        project.fetched_at = datetime.now(timezone.utc)
-        project.name = project_data.name
-        project.color = project_data.color
-        project.client = Client.to_dbref_pk(project_data.client_id)
+    def create_or_update_via_api_data(
+        cls, project_data: ProjectData
+    ) -> tuple[int, int]:
+        return cls.bulk_create_or_update_via_api_data([project_data])
 
-        return project.save()
+    @classmethod
+    def bulk_create_or_update_via_api_data(
+        cls, project_dataset: list[ProjectData]
+    ) -> tuple[int, int]:
+        return cls.bulk_upsert(list(map(cls.api_data_to_mongo, project_dataset)))
 
     @classmethod
-    def delete_via_ids(cls, project_ids: set) -> None:
-        projects = Project.objects(project_id__in=project_ids)
+    def api_data_to_mongo(cls, project_data: ProjectData) -> tuple:
+        return (
+            project_data.id,
+            {
+                "name": project_data.name,
+                "color": project_data.color,
+                "client_id": project_data.client_id,
+            },
+            {"workspace_id": project_data.workspace_id},
+        )
 
-        for time_entry in TimeEntry.objects(project__in=projects):
-            time_entry.project = None
-            time_entry.save()
+    @classmethod
+    def delete_via_ids(cls, project_ids: set) -> int:
+        time_entries_unlinked = TimeEntry.bulk_unlink("project_id", project_ids)
+        if time_entries_unlinked > 0:
+            logging.info(
+                "Time entries unlinked from deleted projects: %i", time_entries_unlinked
+            )
 
-        for project in projects:
-            project.delete()
+        return cls.bulk_delete(project_ids)
 
     @classmethod
-    def delete_via_id(cls, project_id: int) -> None:
-        cls.delete_via_ids((project_id,))
+    def delete_via_id(cls, project_id: int) -> int:
+        return cls.delete_via_ids((project_id,))
 
 
 class Tag(BaseDocument):
@@ -303,34 +532,38 @@ class Tag(BaseDocument):
     tag_id = IntField(primary_key=True, required=True)
     workspace = ReferenceField(Workspace, db_field="workspace_id", required=True)
     fetched_at = DateTimeField(required=True)
+    content_hash = StringField()
     name = StringField(required=True)
 
-    meta = {"collection": COLLECTION_NAME}
+    meta = {"collection": COLLECTION_NAME, "indexes": ["workspace"]}
 
     @classmethod
-    def create_or_update_via_api_data(cls, tag_data: TagData) -> "Tag":
-        try:
-            tag = Tag.objects.get(tag_id=tag_data.id)
-        except DoesNotExist:
-            tag = Tag(
-                tag_id=tag_data.id,
-                workspace=Workspace.to_dbref_pk(tag_data.workspace_id),
-            )
+    def create_or_update_via_api_data(cls, tag_data: TagData) -> tuple[int, int]:
+        return cls.bulk_create_or_update_via_api_data([tag_data])
 
-        tag.fetched_at = datetime.now(timezone.utc)
-        tag.name = tag_data.name
+    @classmethod
+    def bulk_create_or_update_via_api_data(
+        cls, tag_dataset: list[TagData]
+    ) -> tuple[int, int]:
+        return cls.bulk_upsert(list(map(cls.api_data_to_mongo, tag_dataset)))
 
-        return tag.save()
+    @classmethod
+    def api_data_to_mongo(cls, tag_data: TagData) -> tuple:
+        return (
+            tag_data.id,
+            {
+                "name": tag_data.name,
+            },
+            {"workspace_id": tag_data.workspace_id},
+        )
 
     @classmethod
-    def delete_via_ids(cls, tag_ids: set) -> None:
-        tags = Tag.objects(tag_id__in=tag_ids)
-        for tag in tags:
-            tag.delete()
+    def delete_via_ids(cls, tag_ids: set) -> int:
+        return cls.bulk_delete(tag_ids)
 
     @classmethod
-    def delete_via_id(cls, tag_id: int) -> None:
-        cls.delete_via_ids((tag_id,))
+    def delete_via_id(cls, tag_id: int) -> int:
+        return cls.delete_via_ids((tag_id,))
 
 
 class Event(BaseDocument):
@@ -343,6 +576,8 @@ class Event(BaseDocument):
     mod_relative = FloatField(required=True)
     mod_absolute = IntField(required=True)
 
+    meta = {"indexes": [("user", "workspace")]}
+
 
 class Schedule(BaseDocument):
     source_uid = StringField(primary_key=True, required=True)
@@ -353,9 +588,14 @@ class Schedule(BaseDocument):
     rrule = StringField()
     target = IntField(required=True)
 
+    meta = {"indexes": [("user", "workspace")]}
+
 
 class TimeEntry(BaseDocument):
     COLLECTION_NAME = "time_entry"
+    TRACKED_FIELDS = ("user_id", "workspace_id", "started_at", "stopped_at")
+    # Documents per cursor batch of bulk reads that only project a few fields
+    READ_BATCH_SIZE = 5000
 
     time_entry_id = IntField(primary_key=True, required=True)
     user = ReferenceField(User, db_field="user_id", required=True)
@@ -363,69 +603,470 @@ class TimeEntry(BaseDocument):
     project = ReferenceField(Project, db_field="project_id")
     tags = ListField(ReferenceField(Tag), db_field="tag_ids")
     fetched_at = DateTimeField(required=True)
+    content_hash = StringField()
     description = StringField(required=True)
     started_at = DateTimeField(required=True)
     stopped_at = DateTimeField()
 
-    meta = {"collection": COLLECTION_NAME}
+    meta = {
+        "collection": COLLECTION_NAME,
+        "indexes": [
+            # serves range queries per user/workspace and lookups per workspace
+            ("workspace", "user", "started_at"),
+            "project",
+        ],
+    }
 
     @classmethod
     def create_or_update_via_api_data(
         cls, time_entry_data: TimeEntryData
-    ) -> "TimeEntry":
-        try:
-            time_entry = TimeEntry.objects.get(time_entry_id=time_entry_data.id)
-        except DoesNotExist:
-            time_entry = TimeEntry()
-            time_entry.time_entry_id = time_entry_data.id
-            time_entry.workspace = Workspace.to_dbref_pk(time_entry_data.workspace_id)
-            time_entry.user = User.to_dbref_pk(time_entry_data.user_id)
+    ) -> tuple[int, int]:
+        return cls.bulk_create_or_update_via_api_data([time_entry_data])
 
-        time_entry.fetched_at = datetime.now(timezone.utc)
-        time_entry.description = time_entry_data.description
-        time_entry.started_at = datetime.fromisoformat(time_entry_data.start)
-        if time_entry_data.stop is not None:
-            time_entry.stopped_at = datetime.fromisoformat(time_entry_data.stop)
-        else:
-            time_entry.stopped_at = None
-        time_entry.project_id = Project.to_dbref_pk(time_entry_data.project_id)
-        time_entry.tag_ids = Tag.to_dbref_pks(time_entry_data.tag_ids)
+    @classmethod
+    def bulk_create_or_update_via_api_data(
+        cls, time_entry_dataset: list[TimeEntryData]
+    ) -> tuple[int, int]:
+        return cls.bulk_upsert(list(map(cls.api_data_to_mongo, time_entry_dataset)))
 
-        return time_entry.save()
+    @classmethod
+    def api_data_to_mongo(cls, time_entry_data: TimeEntryData) -> tuple:
+        return (
+            time_entry_data.id,
+            {
+                "description": time_entry_data.description,
+                "started_at": datetime.fromisoformat(time_entry_data.start),
+                "stopped_at": (
+                    datetime.fromisoformat(time_entry_data.stop)
+                    if time_entry_data.stop is not None
+                    else None
+                ),
+                "project_id": time_entry_data.project_id,
+                "tag_ids": time_entry_data.tag_ids or [],
+            },
+            {
+                "workspace_id": time_entry_data.workspace_id,
+                "user_id": time_entry_data.user_id,
+            },
+        )
 
     @classmethod
     def create_or_update_via_report_api_data(
         cls, time_entry_report_data: TimeEntryReportData, workspace_id: int
-    ) -> "TimeEntry":
-        try:
-            time_entry = TimeEntry.objects.get(
-                time_entry_id=time_entry_report_data.time_entries[0].id
+    ) -> tuple[int, int]:
+        return cls.bulk_create_or_update_via_report_api_data(
+            [time_entry_report_data], workspace_id
+        )
+
+    @classmethod
+    def bulk_create_or_update_via_report_api_data(
+        cls, time_entry_report_dataset: list[TimeEntryReportData], workspace_id: int
+    ) -> tuple[int, int]:
+        return cls.bulk_upsert(
+            list(
+                map(
+                    lambda d: cls.report_api_data_to_mongo(d, workspace_id),
+                    time_entry_report_dataset,
+                )
             )
-        except DoesNotExist:
-            time_entry = TimeEntry()
-            time_entry.time_entry_id = time_entry_report_data.time_entries[0].id
-            time_entry.workspace = Workspace.to_dbref_pk(workspace_id)
-            time_entry.user = User.to_dbref_pk(time_entry_report_data.user_id)
+        )
 
+    @classmethod
+    def report_api_data_to_mongo(
+        cls, time_entry_report_data: TimeEntryReportData, workspace_id: int
+    ) -> tuple:
         # Time Entries from a report does always have a start and stop time set
-        start_dt = datetime.fromisoformat(time_entry_report_data.time_entries[0].start)
-        stop_dt = datetime.fromisoformat(time_entry_report_data.time_entries[0].stop)
+        sub_time_entry_data = time_entry_report_data.time_entries[0]
+
+        return (
+            sub_time_entry_data.id,
+            {
+                "description": time_entry_report_data.description,
+                "started_at": datetime.fromisoformat(sub_time_entry_data.start),
+                "stopped_at": datetime.fromisoformat(sub_time_entry_data.stop),
+                "project_id": time_entry_report_data.project_id,
+                "tag_ids": time_entry_report_data.tag_ids or [],
+            },
+            {
+                "workspace_id": workspace_id,
+                "user_id": time_entry_report_data.user_id,
+            },
+        )
+
+    @classmethod
+    def after_bulk_upsert(
+        cls, changed_rows: list[tuple[Any, dict, dict]], previous_documents: dict
+    ) -> None:
+        previous_intervals = []
+        intervals = []
+        for primary_key, set_fields, insert_fields in changed_rows:
+            previous_document = previous_documents.get(primary_key)
+            if previous_document is not None:
+                previous_intervals.append(cls.raw_interval(previous_document))
+            intervals.append(
+                cls.raw_interval(
+                    {**insert_fields, **(previous_document or {}), **set_fields}
+                )
+            )
+        Workspace.raise_max_time_entry_durations(cls.get_max_durations(intervals))
+        DailyTotal.refresh_intervals(previous_intervals + intervals)
+        HeatmapCounter.apply_intervals(previous_intervals, intervals)
+
+    @classmethod
+    def delete_via_ids(cls, time_entry_ids: set) -> int:
+        if len(time_entry_ids) == 0:
+            return 0
+
+        previous_documents = cls._get_collection().find(
+            {"_id": {"$in": list(time_entry_ids)}},
+            {f: 1 for f in cls.TRACKED_FIELDS},
+        )
+        intervals = list(map(cls.raw_interval, previous_documents))
+        deleted = cls.bulk_delete(time_entry_ids)
+        DailyTotal.refresh_intervals(intervals)
+        HeatmapCounter.apply_intervals(intervals, [])
+
+        return deleted
+
+    @classmethod
+    def delete_via_id(cls, time_entry_id: int) -> int:
+        return cls.delete_via_ids((time_entry_id,))
+
+    @classmethod
+    def get_overlap_query(
+        cls,
+        user_id: int,
+        workspace_id: int,
+        lower: datetime,
+        upper: datetime | None = None,
+    ) -> dict:
+        """
+        Returns a raw query for all stopped time entries that overlap the
+        range from lower to upper. The start of the entries is bounded by the
+        maximum time entry duration of the workspace, so the query is served
+        by a single range scan of the (workspace, user, started_at) index.
+        """
+        workspace = Workspace._get_collection().find_one(
+            {"_id": workspace_id}, {"max_time_entry_duration": 1}
+        )
+        max_duration = (workspace or {}).get("max_time_entry_duration")
+
+        started_at = {}
+        if upper is not None:
+            started_at["$lt"] = upper
+        if max_duration is not None:
+            started_at["$gte"] = lower - timedelta(seconds=max_duration)
+
+        query = {"workspace_id": workspace_id, "user_id": user_id}
+        if len(started_at) > 0:
+            query["started_at"] = started_at
+        query["stopped_at"] = {"$gt": lower}
+
+        return query
+
+    @classmethod
+    def get_max_durations(cls, intervals: list[tuple]) -> dict[int, int]:
+        """
+        Returns the maximum duration in full seconds per workspace of the
+        given raw time entry intervals.
+        """
+        durations = {}
+        for _, workspace_id, started_at, stopped_at in intervals:
+            if started_at and stopped_at:
+                duration = math.ceil((stopped_at - started_at).total_seconds())
+                durations[workspace_id] = max(durations.get(workspace_id, 0), duration)
+
+        return durations
+
+    @classmethod
+    def raw_interval(cls, document: dict) -> tuple:
+        return (
+            document.get("user_id"),
+            document.get("workspace_id"),
+            document.get("started_at"),
+            document.get("stopped_at"),
+        )
+
+
+class DailyTotal(BaseDocument):
+    """
+    Tracked time per local day of a user, maintained whenever time entries
+    are written. Only complete when UserWorkspace.daily_totals_timezone
+    matches the timezone of the user.
+    """
+
+    COLLECTION_NAME = "daily_total"
+
+    user = ReferenceField(User, db_field="user_id", required=True)
+    workspace = ReferenceField(Workspace, db_field="workspace_id", required=True)
+    date = DateField(required=True)
+    actual_time = IntField(required=True)
+    time_entry_count = IntField(required=True)
+
+    meta = {
+        "collection": COLLECTION_NAME,
+        "indexes": [{"fields": ("user", "workspace", "date"), "unique": True}],
+    }
 
-        time_entry.fetched_at = datetime.now(timezone.utc)
-        time_entry.description = time_entry_report_data.description
-        time_entry.started_at = start_dt
-        time_entry.stopped_at = stop_dt
-        time_entry.project_id = Project.to_dbref_pk(time_entry_report_data.project_id)
-        time_entry.tag_ids = Tag.to_dbref_pks(time_entry_report_data.tag_ids)
+    @classmethod
+    def refresh_intervals(cls, intervals: list[tuple]) -> None:
+        """
+        Recalculates all local days touched by the given raw time entry
+        intervals of (user_id, workspace_id, started_at, stopped_at).
+        """
+        intervals = list(filter(lambda i: i[2] and i[3], intervals))
+        if len(intervals) == 0:
+            return
+
+        users = User.objects(user_id__in=set(map(lambda i: i[0], intervals))).only(
+            "timezone", "workspaces"
+        )
+        timezone_tables = {}
+        current_keys = set()
+        for user in users:
+            timezone_tables[user.user_id] = TimezoneTable.for_name(user.timezone)
+            # totals in an outdated timezone are replaced by the next rebuild
+            for user_workspace in user.workspaces:
+                if user_workspace.daily_totals_timezone == user.timezone:
+                    workspace_id = ReferenceCache.get_reference_id(
+                        user_workspace, "workspace"
+                    )
+                    current_keys.add((user.user_id, workspace_id))
+
+        days = defaultdict(set)
+        for user_id, workspace_id, started_at, stopped_at in intervals:
+            if (user_id, workspace_id) not in current_keys:
+                continue
+            for day, _ in timezone_tables[user_id].slice(
+                started_at.timestamp(), stopped_at.timestamp()
+            ):
+                days[(user_id, workspace_id)].add(date.fromordinal(day))
 
-        return time_entry.save()
+        for (user_id, workspace_id), dates in days.items():
+            cls.refresh(user_id, workspace_id, timezone_tables[user_id], dates)
 
     @classmethod
-    def delete_via_ids(cls, time_entry_ids: set) -> None:
-        time_entries = TimeEntry.objects(time_entry_id__in=time_entry_ids)
+    def refresh(
+        cls,
+        user_id: int,
+        workspace_id: int,
+        timezone_table: TimezoneTable,
+        dates: set[date],
+    ) -> None:
+        lower = timezone_table.local_midnight(min(dates))
+        upper = timezone_table.local_midnight(max(dates) + timedelta(days=1))
+        totals = cls.compute_totals(
+            timezone_table,
+            TimeEntry.get_overlap_query(user_id, workspace_id, lower, upper),
+        )
+
+        requests = []
+        for day in dates:
+            query = {
+                "user_id": user_id,
+                "workspace_id": workspace_id,
+                "date": datetime.combine(day, time.min),
+            }
+            if day in totals:
+                actual_time, time_entry_count = totals[day]
+                requests.append(
+                    UpdateOne(
+                        query,
+                        {
+                            "$set": {
+                                "actual_time": actual_time,
+                                "time_entry_count": time_entry_count,
+                            }
+                        },
+                        upsert=True,
+                    )
+                )
+            else:
+                requests.append(DeleteOne(query))
+
+        cls._get_collection().bulk_write(requests, ordered=False)
+
+    @classmethod
+    def rebuild(cls, user: User, workspace: Workspace) -> int:
+        """
+        Recalculates all days of a user workspace in the current timezone of
+        the user. The caller has to store the user afterwards.
+        """
+        totals = cls.compute_totals(
+            TimezoneTable.for_name(user.timezone),
+            {
+                "user_id": user.user_id,
+                "workspace_id": workspace.workspace_id,
+                "stopped_at": {"$ne": None},
+            },
+        )
+
+        collection = cls._get_collection()
+        collection.delete_many(
+            {"user_id": user.user_id, "workspace_id": workspace.workspace_id}
+        )
+        if len(totals) > 0:
+            collection.insert_many(
+                [
+                    {
+                        "user_id": user.user_id,
+                        "workspace_id": workspace.workspace_id,
+                        "date": datetime.combine(day, time.min),
+                        "actual_time": actual_time,
+                        "time_entry_count": time_entry_count,
+                    }
+                    for day, (actual_time, time_entry_count) in totals.items()
+                ]
+            )
+
+        user.workspaces.get(workspace=workspace).daily_totals_timezone = user.timezone
+
+        return len(totals)
+
+    @classmethod
+    def compute_totals(
+        cls, timezone_table: TimezoneTable, query: dict
+    ) -> dict[date, list[int]]:
+        time_entries = TimeEntry._get_collection().find(
+            query,
+            {"started_at": 1, "stopped_at": 1},
+            batch_size=TimeEntry.READ_BATCH_SIZE,
+        )
+
+        totals = defaultdict(lambda: [0, 0])
         for time_entry in time_entries:
-            time_entry.delete()
+            for day, duration in timezone_table.slice(
+                time_entry["started_at"].timestamp(),
+                time_entry["stopped_at"].timestamp(),
+            ):
+                total = totals[date.fromordinal(day)]
+                total[0] += int(duration)
+                total[1] += 1
+
+        return totals
+
+
+class HeatmapCounter(BaseDocument):
+    """
+    Number of tracked minutes per local minute of the week of a user, counting
+    all time entries since the start of aggregation. Maintained whenever time
+    entries are written, but only valid while timezone and start date match
+    the current settings of the user.
+    """
+
+    COLLECTION_NAME = "heatmap_counter"
+
+    user = ReferenceField(User, db_field="user_id", required=True)
+    workspace = ReferenceField(Workspace, db_field="workspace_id", required=True)
+    timezone = StringField(required=True)
+    start_date = DateField(required=True)
+    counts = ListField(IntField(), required=True)
+
+    meta = {
+        "collection": COLLECTION_NAME,
+        "indexes": [{"fields": ("user", "workspace"), "unique": True}],
+    }
 
     @classmethod
-    def delete_via_id(cls, time_entry_id: int) -> None:
-        cls.delete_via_ids((time_entry_id,))
+    def get_valid(cls, user: User, workspace: Workspace) -> "HeatmapCounter | None":
+        user_workspace = user.workspaces.get(workspace=workspace)
+        return cls.objects(
+            user=user,
+            workspace=workspace,
+            timezone=user.timezone,
+            start_date=user_workspace.start_of_aggregation,
+        ).first()
+
+    @classmethod
+    def apply_intervals(cls, removed: list[tuple], added: list[tuple]) -> None:
+        """
+        Subtracts and adds raw time entry intervals of
+        (user_id, workspace_id, started_at, stopped_at) to the stored counters.
+        """
+        weighted_intervals = [(-1, i) for i in removed] + [(1, i) for i in added]
+        weighted_intervals = list(filter(lambda i: i[1][3], weighted_intervals))
+        if len(weighted_intervals) == 0:
+            return
+
+        collection = cls._get_collection()
+        counters = {
+            (document["user_id"], document["workspace_id"]): document
+            for document in collection.find(
+                {
+                    "$or": [
+                        {"user_id": user_id, "workspace_id": workspace_id}
+                        for user_id, workspace_id in {
+                            (i[0], i[1]) for _, i in weighted_intervals
+                        }
+                    ]
+                },
+                {"user_id": 1, "workspace_id": 1, "timezone": 1, "start_date": 1},
+            )
+        }
+
+        markers = defaultdict(WeekMinutes.create_markers)
+        for weight, interval in weighted_intervals:
+            user_id, workspace_id, started_at, stopped_at = interval
+            counter = counters.get((user_id, workspace_id))
+            if counter is None:
+                # not built yet, the next rebuild includes the interval
+                continue
+
+            timezone_table = TimezoneTable.for_name(counter["timezone"])
+            lower = timezone_table.local_midnight(counter["start_date"].date())
+            if stopped_at > lower:
+                WeekMinutes.add_interval(
+                    markers[counter["_id"]],
+                    started_at,
+                    stopped_at,
+                    timezone_table,
+                    weight,
+                )
+
+        requests = []
+        for counter_id, counter_markers in markers.items():
+            increments = {
+                f"counts.{minute}": count
+                for minute, count in enumerate(WeekMinutes.to_counts(counter_markers))
+                if count != 0
+            }
+            if len(increments) > 0:
+                requests.append(UpdateOne({"_id": counter_id}, {"$inc": increments}))
+
+        if len(requests) > 0:
+            collection.bulk_write(requests, ordered=False)
+
+    @classmethod
+    def rebuild(cls, user: User, workspace: Workspace) -> None:
+        user_workspace = user.workspaces.get(workspace=workspace)
+        timezone_table = TimezoneTable.for_name(user.timezone)
+        lower = timezone_table.local_midnight(user_workspace.start_of_aggregation)
+
+        time_entries = TimeEntry._get_collection().find(
+            TimeEntry.get_overlap_query(user.user_id, workspace.workspace_id, lower),
+            {"started_at": 1, "stopped_at": 1},
+            batch_size=TimeEntry.READ_BATCH_SIZE,
+        )
+
+        markers = WeekMinutes.create_markers()
+        for time_entry in time_entries:
+            WeekMinutes.add_interval(
+                markers,
+                time_entry["started_at"],
+                time_entry["stopped_at"],
+                timezone_table,
+            )
+
+        cls._get_collection().update_one(
+            {"user_id": user.user_id, "workspace_id": workspace.workspace_id},
+            {
+                "$set": {
+                    "timezone": user.timezone,
+                    "start_date": datetime.combine(
+                        user_workspace.start_of_aggregation, time.min
+                    ),
+                    "counts": WeekMinutes.to_counts(markers),
+                }
+            },
+            upsert=True,
+        )
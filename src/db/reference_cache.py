@@ -0,0 +1,109 @@
+from collections.abc import Iterable
+from typing import Any
+
+from bson import DBRef
+from mongoengine import Document
+
+from src.util.lru_cache import LruCache
+
+
+class ReferenceCache:
+    """
+    Process local cache of rarely changing documents that are referenced by
+    other documents (organizations, workspaces, projects, ...), keyed by
+    collection and primary key. Entries expire after TTL seconds, so changes
+    written by other processes become visible eventually. Writes through the
+    bulk methods of BaseDocument invalidate the entries immediately.
+    """
+
+    MAX_SIZE = 4096
+    TTL = 300
+
+    __cache = LruCache(MAX_SIZE, TTL)
+
+    @classmethod
+    def get(cls, document_cls: type[Document], primary_key: Any) -> Document | None:
+        return cls.get_many(document_cls, [primary_key]).get(primary_key)
+
+    @classmethod
+    def get_many(
+        cls, document_cls: type[Document], primary_keys: Iterable[Any]
+    ) -> dict[Any, Document]:
+        """
+        Returns the cached documents with the given primary keys and loads all
+        missing documents with a single query. Unknown keys are left out.
+        """
+        collection_name = document_cls._get_collection_name()
+        documents = {}
+        missing_primary_keys = set()
+        for primary_key in primary_keys:
+            document = cls.__cache.get((collection_name, primary_key))
+            if document is None:
+                missing_primary_keys.add(primary_key)
+            else:
+                documents[primary_key] = document
+
+        if len(missing_primary_keys) > 0:
+            for document in document_cls.objects(pk__in=list(missing_primary_keys)):
+                cls.__cache.put((collection_name, document.pk), document)
+                documents[document.pk] = document
+
+        return documents
+
+    @classmethod
+    def prefetch(cls, documents: Iterable[Any], field_name: str) -> None:
+        """
+        Resolves the reference field_name of all given documents or embedded
+        documents at once, so accessing it does not query each reference.
+        """
+        documents = list(filter(lambda d: d is not None, documents))
+        if len(documents) == 0:
+            return
+
+        document_cls = documents[0]._fields[field_name].document_type
+        references = {}
+        for document in documents:
+            primary_key = cls.get_reference_id(document, field_name)
+            if primary_key is not None:
+                references[id(document)] = primary_key
+
+        referenced_documents = cls.get_many(document_cls, set(references.values()))
+        for document in documents:
+            referenced_document = referenced_documents.get(references.get(id(document)))
+            if referenced_document is not None:
+                # bypass the field to not mark the reference as changed
+                document._data[field_name] = referenced_document
+
+    @classmethod
+    def get_reference_id(cls, document: Any, field_name: str) -> Any:
+        """
+        Returns the primary key stored in a reference field without
+        dereferencing it.
+        """
+        value = document._data.get(field_name)
+        if isinstance(value, Document):
+            return value.pk
+        elif isinstance(value, DBRef):
+            return value.id
+        return value
+
+    @classmethod
+    def invalidate(
+        cls, document_cls: type[Document], primary_keys: Iterable[Any] = None
+    ) -> int:
+        """
+        Removes the given documents, or all documents of the class if no
+        primary keys are given.
+        """
+        collection_name = document_cls._get_collection_name()
+        if primary_keys is None:
+            return cls.__cache.invalidate(lambda key: key[0] == collection_name)
+
+        primary_keys = set(primary_keys)
+        return cls.__cache.invalidate(
+            lambda key: key[0] == collection_name and key[1] in primary_keys
+        )
+
+    @classmethod
+    def clear(cls) -> None:
+        cls.__cache.clear()
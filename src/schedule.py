@@ -1,13 +1,28 @@
+from collections.abc import Iterator
 from datetime import date, datetime, timedelta
+from itertools import accumulate
+import hashlib
 import re
 import httpx
 from dateutil.rrule import rrulestr
 from dateutil.relativedelta import relativedelta
 from icalendar import Calendar
 from mongoengine import Document
-from mongoengine.queryset.visitor import Q
-from src.db.entity import User, Workspace, Schedule, Event, TimeEntry
-from pytz import utc, timezone
+from src.db.entity import (
+    User,
+    UserWorkspace,
+    Workspace,
+    Schedule,
+    Event,
+    TimeEntry,
+    DailyTotal,
+    HeatmapCounter,
+)
+from src.util.ics_filter import IcsFilter
+from src.util.lru_cache import LruCache
+from src.util.timezone_table import TimezoneTable
+from src.util.week_minutes import WeekMinutes
+from pytz import utc
 
 
 class Day:
@@ -15,24 +30,44 @@ class Day:
         self.date = day_date
         self.schedules = set()
         self.events = set()
-        self.time_entry_slices = set()
+        self.tracked_time = 0
+        self.tracked_time_entry_count = 0
+        self.__target_time = None
 
     @classmethod
-    def get_id_by_day(cls, day: date) -> str:
-        return day.strftime("%Y-%m-%d")
+    def get_id_by_day(cls, day: date) -> int:
+        return day.toordinal()
 
-    def get_id(self) -> str:
+    def get_id(self) -> int:
         return Day.get_id_by_day(self.date)
 
+    def finalize(self) -> None:
+        """
+        Caches the target time. Schedules and events must not change anymore.
+        """
+        self.__target_time = self.__compute_target_time()
+
     def target_time(self) -> int:
+        if self.__target_time is None:
+            return self.__compute_target_time()
+        return self.__target_time
+
+    def __compute_target_time(self) -> int:
         target_base = sum(map(lambda s: s.target, self.schedules))
         target_mod_relative = 1 + sum(map(lambda e: e.mod_relative, self.events))
         target_mod_absolute = sum(map(lambda e: e.mod_absolute, self.events))
 
         return int(target_base * target_mod_relative + target_mod_absolute)
 
+    def add_tracked_time(self, actual_time: int, time_entry_count: int = 1) -> None:
+        self.tracked_time += actual_time
+        self.tracked_time_entry_count += time_entry_count
+
     def actual_time(self) -> int:
-        return sum(map(lambda tes: tes.get_duration(), self.time_entry_slices))
+        return self.tracked_time
+
+    def time_entry_count(self) -> int:
+        return self.tracked_time_entry_count
 
     def delta(self) -> int:
         return self.actual_time() - self.target_time()
@@ -52,41 +87,62 @@ class Day:
         )
 
 
-class TimeEntrySlice:
-    def __init__(self, time_entry: TimeEntry, start: datetime, end: datetime) -> None:
-        self.time_entry = time_entry
-        self.start = start
-        self.end = end
-
-    def get_duration(self):
-        return int((self.end - self.start).total_seconds())
-
-
 class DayAggregate:
     def __init__(self, start_date: date, end_date: date):
         self.days = set()
         self.start = start_date
         self.end = end_date
         self.max_days = (end_date - start_date).days + 1
+        self.__totals = None
 
     @classmethod
     def get_key_from_date(cls, day_date: date) -> tuple:
         raise NotImplementedError("Not implemented yet!")
 
+    @classmethod
+    def from_key(cls, key: tuple) -> "DayAggregate":
+        return cls(*key)
+
+    def finalize(self) -> None:
+        """
+        Caches all totals. The days must be finalized and not change anymore.
+        """
+        self.__totals = self.__compute_totals()
+
     def days_with_target_time(self) -> tuple:
-        return len(set(filter(lambda day: day.target_time() > 0, self.days)))
+        return self.__get_totals()[2]
 
     def days_with_actual_time(self) -> tuple:
-        return len(set(filter(lambda day: day.actual_time() > 0, self.days)))
+        return self.__get_totals()[3]
 
     def get_key(self) -> tuple:
         return __class__.get_key_from_date(self.start)
 
     def target_time(self) -> int:
-        return sum(map(lambda x: x.target_time(), self.days))
+        return self.__get_totals()[0]
 
     def actual_time(self) -> int:
-        return sum(map(lambda x: x.actual_time(), self.days))
+        return self.__get_totals()[1]
+
+    def __get_totals(self) -> tuple[int, int, int, int]:
+        if self.__totals is None:
+            return self.__compute_totals()
+        return self.__totals
+
+    def __compute_totals(self) -> tuple[int, int, int, int]:
+        target_time = 0
+        actual_time = 0
+        days_with_target_time = 0
+        days_with_actual_time = 0
+        for day in self.days:
+            day_target_time = day.target_time()
+            day_actual_time = day.actual_time()
+            target_time += day_target_time
+            actual_time += day_actual_time
+            days_with_target_time += day_target_time > 0
+            days_with_actual_time += day_actual_time > 0
+
+        return target_time, actual_time, days_with_target_time, days_with_actual_time
 
     def delta(self) -> int:
         return self.actual_time() - self.target_time()
@@ -180,6 +236,10 @@ class Year(DayAggregate):
     def get_key_from_date(cls, day_date: date) -> int:
         return day_date.year
 
+    @classmethod
+    def from_key(cls, key: int) -> "Year":
+        return cls(key)
+
     def get_key(self) -> tuple:
         return __class__.get_key_from_date(self.start)
 
@@ -206,7 +266,50 @@ class All(DayAggregate):
         )
 
 
+class CumulativeTotals:
+    """
+    Prefix sums of the target and actual time of consecutive days, starting
+    at start_date. Answers range queries in constant time.
+    """
+
+    def __init__(
+        self, start_date: date, target_times: list[int], actual_times: list[int]
+    ) -> None:
+        self.start_date = start_date
+        self.day_count = len(target_times)
+        self.target_times = list(accumulate(target_times, initial=0))
+        self.actual_times = list(accumulate(actual_times, initial=0))
+
+    def range_totals(self, start_date: date, end_date: date) -> tuple[int, int]:
+        """
+        Returns target and actual time from start_date to end_date (inclusive).
+        Days outside of the covered range count as zero.
+        """
+        start = self.__offset(start_date)
+        end = self.__offset(end_date + timedelta(days=1))
+        if start >= end:
+            return 0, 0
+
+        return (
+            self.target_times[end] - self.target_times[start],
+            self.actual_times[end] - self.actual_times[start],
+        )
+
+    def balance(self, start_date: date, end_date: date) -> int:
+        target_time, actual_time = self.range_totals(start_date, end_date)
+        return actual_time - target_time
+
+    def running_balance(self, day_date: date) -> int:
+        return self.balance(self.start_date, day_date)
+
+    def __offset(self, day_date: date) -> int:
+        return min(max((day_date - self.start_date).days, 0), self.day_count)
+
+
 class Report:
+    # Aggregates by granularity, built on first access
+    GRANULARITIES = {"week": Week, "month": Month, "quarter": Quarter, "year": Year}
+
     def __init__(
         self,
         user: User,
@@ -220,54 +323,119 @@ class Report:
         self.start_date = start_date
         self.end_date = end_date
         self.days = days
-        self.weeks = {}
-        self.months = {}
-        self.quarters = {}
-        self.years = {}
-        self.all = All(start_date, end_date)
+        self.cumulative = None
+        self.__aggregates = {}
+        self.__all = None
+
+    @property
+    def weeks(self) -> dict[tuple, Week]:
+        return self.get_aggregates("week")
+
+    @property
+    def months(self) -> dict[tuple, Month]:
+        return self.get_aggregates("month")
+
+    @property
+    def quarters(self) -> dict[tuple, Quarter]:
+        return self.get_aggregates("quarter")
+
+    @property
+    def years(self) -> dict[int, Year]:
+        return self.get_aggregates("year")
+
+    @property
+    def all(self) -> All:
+        if self.__all is None:
+            aggregate = All(self.start_date, self.end_date)
+            aggregate.days.update(self.days.values())
+            aggregate.finalize()
+            self.__all = aggregate
+
+        return self.__all
+
+    def get_aggregates(self, granularity: str) -> dict:
+        """
+        Returns the aggregates of a granularity (see GRANULARITIES) by key.
+        They are built on first access, so callers only pay for the
+        granularities they use.
+        """
+        if granularity not in self.GRANULARITIES:
+            raise ValueError(f"Unknown granularity {granularity}")
+
+        if granularity not in self.__aggregates:
+            aggregate_cls = self.GRANULARITIES[granularity]
+            aggregates = {}
+            for day in self.days.values():
+                key = aggregate_cls.get_key_from_date(day.date)
+                if key not in aggregates:
+                    aggregates[key] = aggregate_cls.from_key(key)
+                aggregates[key].days.add(day)
+            for aggregate in aggregates.values():
+                aggregate.finalize()
+            self.__aggregates[granularity] = aggregates
+
+        return self.__aggregates[granularity]
+
+    def finalize(self) -> None:
+        for day in self.days.values():
+            day.finalize()
+
+        self.cumulative = CumulativeTotals(
+            self.start_date,
+            [day.target_time() for day in self.days.values()],
+            [day.actual_time() for day in self.days.values()],
+        )
+
+        # aggregates are built again from the finalized days
+        self.__aggregates = {}
+        self.__all = None
 
     def running_delta(self):
+        if self.cumulative is not None:
+            return self.cumulative.balance(self.start_date, self.end_date)
+
         running_delta = 0
         for day in self.days.values():
             running_delta += day.delta()
 
         return running_delta
 
+    def balance(self, start_date: date, end_date: date) -> int:
+        return self.cumulative.balance(start_date, end_date)
 
-class TimeEntryFilter:
-    # There is no timezone that differs more than +/- 15 hours from UTC
-    TIMEZONE_TOLERANCE_HOURS = 15
+    def running_balance(self, day_date: date) -> int:
+        return self.cumulative.running_balance(day_date)
 
+
+class TimeEntryFilter:
     @classmethod
     def fetch_time_entries(
-        cls, user: User, workspace: Workspace, start_date: date, end_date: date
+        cls,
+        user: User,
+        workspace: Workspace,
+        start_date: date,
+        end_date: date,
+        fields: tuple[str] = ("started_at", "stopped_at"),
     ):
-
-        timezone_tolerance = timedelta(hours=__class__.TIMEZONE_TOLERANCE_HOURS)
-
-        start_date_with_offset = (
-            datetime.combine(start_date, datetime.min.time()) - timezone_tolerance
-        )
-        end_date_with_offset = (
-            datetime.combine(end_date + timedelta(days=1), datetime.min.time())
-            + timezone_tolerance
+        """
+        Returns all stopped time entries that overlap the given local days as
+        raw documents that only contain the given fields and the id.
+        """
+        timezone_table = TimezoneTable.for_name(user.timezone)
+        query = TimeEntry.get_overlap_query(
+            user.user_id,
+            workspace.workspace_id,
+            timezone_table.local_midnight(start_date),
+            timezone_table.local_midnight(end_date + timedelta(days=1)),
         )
 
-        time_entries = TimeEntry.objects(
-            Q(user=user)
-            & Q(workspace=workspace)
-            & (
-                Q(started_at__gte=start_date_with_offset)
-                & Q(started_at__lte=end_date_with_offset)
-                | Q(stopped_at__gte=start_date_with_offset)
-                & Q(stopped_at__lte=end_date_with_offset)
-                | Q(started_at__lte=start_date_with_offset)
-                & Q(stopped_at__gte=end_date_with_offset)
-            )
+        return (
+            TimeEntry.objects(__raw__=query)
+            .only(*fields)
+            .as_pymongo()
+            .batch_size(TimeEntry.READ_BATCH_SIZE)
         )
 
-        return time_entries
-
 
 class Heatmap:
     @classmethod
@@ -278,24 +446,38 @@ class Heatmap:
             user, workspace, start_date, end_date
         )
 
-        user_timezone = timezone(user.timezone)
-        values = [[0] * (24 * 60) for _ in range(7)]
+        timezone_table = TimezoneTable.for_name(user.timezone)
 
+        markers = WeekMinutes.create_markers()
         for time_entry in time_entries:
-            if time_entry.stopped_at is None:
-                # Skip time entries that arent finished
-                continue
+            WeekMinutes.add_interval(
+                markers,
+                time_entry["started_at"],
+                time_entry["stopped_at"],
+                timezone_table,
+            )
 
-            started_at_local = time_entry.started_at.astimezone(user_timezone)
-            stopped_at_local = time_entry.stopped_at.astimezone(user_timezone)
+        return Heatmap.create_report_from_counts(WeekMinutes.to_counts(markers))
 
-            current_dt = started_at_local
-            while current_dt <= stopped_at_local:
-                minute = current_dt.hour * 60 + current_dt.minute
-                weekday = current_dt.weekday()
+    @classmethod
+    def load_report(cls, user: User, workspace: Workspace) -> tuple | None:
+        """
+        Returns the stored heatmap since the start of aggregation, if it was
+        built with the current settings of the user.
+        """
+        heatmap_counter = HeatmapCounter.get_valid(user, workspace)
+        if heatmap_counter is None:
+            return None
 
-                values[weekday][minute] += 1
-                current_dt += timedelta(minutes=1)
+        return Heatmap.create_report_from_counts(heatmap_counter.counts)
+
+    @classmethod
+    def create_report_from_counts(cls, counts: list[int]) -> tuple:
+        day_minutes = WeekMinutes.DAY_MINUTES
+        values = [
+            counts[weekday * day_minutes : (weekday + 1) * day_minutes]
+            for weekday in range(7)
+        ]
 
         times = [f"{i // 60:02d}:{i % 60:02d}" for i in range(0, 24 * 60)]
 
@@ -303,11 +485,25 @@ class Heatmap:
 
 
 class Resolver:
-    TIMEZONE_TOLERANCE_HOURS = 15
+    # Engines that compute the actual time from raw time entries
+    ENGINE_PYTHON = "python"
+    ENGINE_AGGREGATION = "aggregation"
+
+    # Expanded rrule occurrences by (source_uid, rrule, start_date, range),
+    # bounded by the total number of stored dates. Entries are never
+    # invalidated: a changed rrule or start date results in a new key, and
+    # stale keys are evicted as least recently used
+    MAX_CACHED_OCCURRENCES = 200_000
+    OCCURRENCE_CACHE = LruCache(MAX_CACHED_OCCURRENCES, get_size=len)
 
     @classmethod
     def create_report(
-        cls, user: User, workspace: Workspace, start_date: date, end_date: date
+        cls,
+        user: User,
+        workspace: Workspace,
+        start_date: date,
+        end_date: date,
+        engine: str = ENGINE_AGGREGATION,
     ):
         report = Report(
             user=user,
@@ -328,55 +524,14 @@ class Resolver:
             Resolver.apply_event(report.days, event, start_date, end_date)
 
         # process time entries
-        timezone_tolerance = timedelta(hours=__class__.TIMEZONE_TOLERANCE_HOURS)
-        start_date_with_offset = (
-            datetime.combine(start_date, datetime.min.time()) - timezone_tolerance
-        )
-        end_date_with_offset = (
-            datetime.combine(end_date + timedelta(days=1), datetime.min.time())
-            + timezone_tolerance
-        )
+        for day_key, actual_time, time_entry_count in Resolver.iter_tracked_time(
+            user, workspace, start_date, end_date, engine
+        ):
+            if day_key in report.days:
+                report.days[day_key].add_tracked_time(actual_time, time_entry_count)
 
-        time_entries = TimeEntry.objects(
-            Q(user=user)
-            & Q(workspace=workspace)
-            & (
-                Q(started_at__gte=start_date_with_offset)
-                & Q(started_at__lte=end_date_with_offset)
-                | Q(stopped_at__gte=start_date_with_offset)
-                & Q(stopped_at__lte=end_date_with_offset)
-                | Q(started_at__lte=start_date_with_offset)
-                & Q(stopped_at__gte=end_date_with_offset)
-            )
-        )
-
-        local_timezone = timezone(user.timezone)
-        for time_entry in time_entries:
-            Resolver.apply_time_entry(report.days, time_entry, local_timezone)
-
-        # aggregate days
-        for day in report.days.values():
-            week_key = Week.get_key_from_date(day.date)
-            if week_key not in report.weeks:
-                report.weeks[week_key] = Week(*week_key)
-            report.weeks[week_key].days.add(day)
-
-            month_key = Month.get_key_from_date(day.date)
-            if month_key not in report.months:
-                report.months[month_key] = Month(*month_key)
-            report.months[month_key].days.add(day)
-
-            quarter_key = Quarter.get_key_from_date(day.date)
-            if quarter_key not in report.quarters:
-                report.quarters[quarter_key] = Quarter(*quarter_key)
-            report.quarters[quarter_key].days.add(day)
-
-            year_key = Year.get_key_from_date(day.date)
-            if year_key not in report.years:
-                report.years[year_key] = Year(year_key)
-            report.years[year_key].days.add(day)
-
-            report.all.days.add(day)
+        # weeks, months, quarters, years and all are aggregated on demand
+        report.finalize()
 
         return report
 
@@ -384,16 +539,7 @@ class Resolver:
     def apply_schedule(
         cls, days: list[Day], schedule: Schedule, start_date: date, end_date: date
     ):
-        start_dt = datetime.combine(start_date, datetime.min.time())
-        end_dt = datetime.combine(end_date, datetime.min.time())
-
-        if schedule.rrule is not None:
-            rrule = rrulestr(schedule.rrule, dtstart=schedule.start_date)
-            apply_dates = list(rrule.between(start_dt, end_dt, inc=True))
-        else:
-            apply_dates = [schedule.start_date]
-
-        for apply_date in apply_dates:
+        for apply_date in Resolver.get_apply_dates(schedule, start_date, end_date):
             day_key = Day.get_id_by_day(apply_date)
             if day_key in days:
                 days[day_key].schedules.add(schedule)
@@ -402,53 +548,177 @@ class Resolver:
     def apply_event(
         cls, days: list[Day], event: Event, start_date: date, end_date: date
     ):
-        start_dt = datetime.combine(start_date, datetime.min.time())
-        end_dt = datetime.combine(end_date, datetime.min.time())
-
-        if event.rrule is not None:
-            rrule = rrulestr(event.rrule, dtstart=event.start_date)
-            apply_dates = list(rrule.between(start_dt, end_dt, inc=True))
-        else:
-            apply_dates = [event.start_date]
-
-        for apply_date in apply_dates:
+        for apply_date in Resolver.get_apply_dates(event, start_date, end_date):
             day_key = Day.get_id_by_day(apply_date)
             if day_key in days:
                 days[day_key].events.add(event)
 
     @classmethod
-    def apply_time_entry(
-        cls, days: list[Day], time_entry: TimeEntry, timezone: timezone
-    ):
-        if time_entry.stopped_at is None:
-            # For now, skip time entries that aren't stopped yet
-            return
-
-        started_at_local = time_entry.started_at.astimezone(timezone)
-        stopped_at_local = time_entry.stopped_at.astimezone(timezone)
-
-        last_slice = False
-        while True:
-            if started_at_local.date() == stopped_at_local.date():
-                time_entry_slice = TimeEntrySlice(
-                    time_entry, started_at_local, stopped_at_local
+    def get_apply_dates(
+        cls, document: Schedule | Event, start_date: date, end_date: date
+    ) -> tuple[date]:
+        if document.rrule is None:
+            return (document.start_date,)
+
+        cache_key = (
+            document.source_uid,
+            document.rrule,
+            document.start_date,
+            start_date,
+            end_date,
+        )
+        apply_dates = cls.OCCURRENCE_CACHE.get(cache_key)
+        if apply_dates is None:
+            start_dt = datetime.combine(start_date, datetime.min.time())
+            end_dt = datetime.combine(end_date, datetime.min.time())
+            rrule = rrulestr(document.rrule, dtstart=document.start_date)
+            apply_dates = tuple(rrule.between(start_dt, end_dt, inc=True))
+            cls.OCCURRENCE_CACHE.put(cache_key, apply_dates)
+
+        return apply_dates
+
+    @classmethod
+    def iter_tracked_time(
+        cls,
+        user: User,
+        workspace: Workspace,
+        start_date: date,
+        end_date: date,
+        engine: str = ENGINE_AGGREGATION,
+    ) -> Iterator[tuple[int, int, int]]:
+        """
+        Yields (day id, actual time, time entry count) tuples. A day id can
+        occur multiple times and may lie outside of the requested range.
+        """
+        user_workspace = user.workspaces.get(workspace=workspace)
+        if user_workspace.daily_totals_timezone == user.timezone:
+            return cls.__iter_daily_totals(user, workspace, start_date, end_date)
+        elif engine == cls.ENGINE_AGGREGATION:
+            return cls.__iter_time_entry_aggregation(
+                user, workspace, start_date, end_date
+            )
+        elif engine == cls.ENGINE_PYTHON:
+            return cls.__iter_time_entries(user, workspace, start_date, end_date)
+        else:
+            raise ValueError(f"Unknown report engine {engine}")
+
+    @classmethod
+    def __iter_daily_totals(
+        cls, user: User, workspace: Workspace, start_date: date, end_date: date
+    ) -> Iterator[tuple[int, int, int]]:
+        daily_totals = (
+            DailyTotal.objects(
+                user=user,
+                workspace=workspace,
+                date__gte=start_date,
+                date__lte=end_date,
+            )
+            .only("date", "actual_time", "time_entry_count")
+            .as_pymongo()
+            .batch_size(TimeEntry.READ_BATCH_SIZE)
+        )
+
+        for daily_total in daily_totals:
+            yield (
+                Day.get_id_by_day(daily_total["date"]),
+                daily_total["actual_time"],
+                daily_total["time_entry_count"],
+            )
+
+    @classmethod
+    def __iter_time_entries(
+        cls, user: User, workspace: Workspace, start_date: date, end_date: date
+    ) -> Iterator[tuple[int, int, int]]:
+        time_entries = TimeEntryFilter.fetch_time_entries(
+            user, workspace, start_date, end_date
+        )
+
+        timezone_table = TimezoneTable.for_name(user.timezone)
+        for time_entry in time_entries:
+            yield from cls.__iter_slices(
+                time_entry["started_at"], time_entry["stopped_at"], timezone_table
+            )
+
+    @classmethod
+    def __iter_time_entry_aggregation(
+        cls, user: User, workspace: Workspace, start_date: date, end_date: date
+    ) -> Iterator[tuple[int, int, int]]:
+        """
+        Sums up the time entries per local day inside of mongodb. Entries that
+        cross midnight are returned as they are and split in python. Each day
+        is a row of its own, so long ranges never hit the document size limit.
+        """
+        timezone_table = TimezoneTable.for_name(user.timezone)
+        lower = timezone_table.local_midnight(start_date)
+        upper = timezone_table.local_midnight(end_date + timedelta(days=1))
+
+        duration = {"$subtract": ["$stopped_at", "$started_at"]}
+        pipeline = [
+            {
+                "$match": TimeEntry.get_overlap_query(
+                    user.user_id, workspace.workspace_id, lower, upper
+                )
+            },
+            {
+                "$project": {
+                    "started_at": 1,
+                    "stopped_at": 1,
+                    "started_day": cls.__local_day_expression(
+                        "$started_at", user.timezone
+                    ),
+                    "stopped_day": cls.__local_day_expression(
+                        "$stopped_at", user.timezone
+                    ),
+                }
+            },
+            {
+                # one row per local day, and one per entry crossing midnight
+                "$group": {
+                    "_id": {
+                        "$cond": [
+                            {"$eq": ["$started_day", "$stopped_day"]},
+                            "$started_day",
+                            "$_id",
+                        ]
+                    },
+                    "crossing_midnight": {
+                        "$first": {"$ne": ["$started_day", "$stopped_day"]}
+                    },
+                    "started_at": {"$first": "$started_at"},
+                    "stopped_at": {"$first": "$stopped_at"},
+                    "actual_time": {"$sum": {"$trunc": {"$divide": [duration, 1000]}}},
+                    "time_entry_count": {"$sum": 1},
+                }
+            },
+        ]
+
+        for row in TimeEntry.objects.aggregate(pipeline):
+            if row["crossing_midnight"]:
+                yield from cls.__iter_slices(
+                    row["started_at"], row["stopped_at"], timezone_table
                 )
-                last_slice = True
             else:
-                next_midnight = started_at_local.replace(
-                    hour=0, minute=0, second=0, microsecond=0
-                ) + timedelta(days=1)
-                time_entry_slice = TimeEntrySlice(
-                    time_entry, started_at_local, next_midnight
+                yield (
+                    date.fromisoformat(row["_id"]).toordinal(),
+                    int(row["actual_time"]),
+                    row["time_entry_count"],
                 )
-                started_at_local = next_midnight
 
-            day_key = Day.get_id_by_day(time_entry_slice.start.date())
-            if day_key in days:
-                days[day_key].time_entry_slices.add(time_entry_slice)
+    @classmethod
+    def __iter_slices(
+        cls, started_at: datetime, stopped_at: datetime, timezone_table: TimezoneTable
+    ) -> Iterator[tuple[int, int, int]]:
+        for day, duration in timezone_table.slice(
+            started_at.timestamp(), stopped_at.timestamp()
+        ):
+            # local days are date ordinals, same as Day.get_id_by_day
+            yield day, int(duration), 1
 
-            if last_slice:
-                break
+    @classmethod
+    def __local_day_expression(cls, field: str, tz_name: str) -> dict:
+        return {
+            "$dateToString": {"format": "%Y-%m-%d", "date": field, "timezone": tz_name}
+        }
 
     @classmethod
     def init_day_objects(cls, start_date: date, end_date: date) -> dict[Day]:
@@ -483,11 +753,69 @@ class CalendarSync:
         + TYPE_EVENT
         + r")((?::\w+=[\w\.-]+)+)(?:</span>|<br/?>)*$"
     )
+    # Calendars are downloaded up to this size in bytes
+    MAX_CALENDAR_SIZE = 50 * 1024 * 1024
+
+    def fetch_calendar(self, user_workspace: UserWorkspace) -> Calendar | None:
+        """
+        Fetches the schedule calendar of a user workspace with a conditional
+        request. Returns None if the calendar did not change since it was
+        processed last. Otherwise the returned calendar only contains
+        annotated events and timezones. The new validators are set on the user
+        workspace in both cases; the caller has to store the user afterwards.
+        Raises ValueError if the calendar exceeds MAX_CALENDAR_SIZE or can not
+        be parsed, and httpx.HTTPError if it can not be fetched.
+        """
+        headers = {}
+        if user_workspace.schedule_calendar_etag is not None:
+            headers["If-None-Match"] = user_workspace.schedule_calendar_etag
+        if user_workspace.schedule_calendar_last_modified is not None:
+            headers["If-Modified-Since"] = (
+                user_workspace.schedule_calendar_last_modified
+            )
+
+        # only annotated events are kept while streaming the calendar
+        content_hash = hashlib.blake2b(digest_size=16)
+        ics_filter = IcsFilter(self.ANNOTATION_PREFIX.encode())
+        size = 0
+        with httpx.stream(
+            "GET", user_workspace.schedule_calendar_url, headers=headers, timeout=20
+        ) as ics:
+            if ics.status_code == 304:
+                return None
+            ics.raise_for_status()
+
+            for chunk in ics.iter_bytes():
+                size += len(chunk)
+                if size > self.MAX_CALENDAR_SIZE:
+                    raise ValueError(f"Calendar exceeds {self.MAX_CALENDAR_SIZE} bytes")
+                content_hash.update(chunk)
+                ics_filter.feed(chunk)
+
+        # servers without stable validators often return the same body
+        if content_hash.hexdigest() == user_workspace.schedule_calendar_hash:
+            self.__set_calendar_validators(user_workspace, ics)
+            return None
+
+        # validators are only stored for calendars that could be parsed
+        ical = Calendar.from_ical(ics_filter.close())
+        self.__set_calendar_validators(user_workspace, ics)
+        user_workspace.schedule_calendar_hash = content_hash.hexdigest()
 
-    def fetch_calendar(self, url: str) -> Calendar:
-        ics = httpx.get(url, timeout=20)
+        return ical
+
+    def __set_calendar_validators(
+        self, user_workspace: UserWorkspace, response: httpx.Response
+    ) -> None:
+        user_workspace.schedule_calendar_etag = response.headers.get("ETag")
+        user_workspace.schedule_calendar_last_modified = response.headers.get(
+            "Last-Modified"
+        )
 
-        return Calendar.from_ical(ics.content)
+    def reset_calendar_validators(self, user_workspace: UserWorkspace) -> None:
+        user_workspace.schedule_calendar_etag = None
+        user_workspace.schedule_calendar_last_modified = None
+        user_workspace.schedule_calendar_hash = None
 
     def get_existing_documents_with_uid(
         self, document_cls: Document, user: User, workspace: Workspace
@@ -1,6 +1,12 @@
+import asyncio
 import httpx
 import time
-from datetime import date
+from collections.abc import AsyncIterator, Callable, Iterator
+from datetime import date, datetime
+from itertools import chain
+from typing import Any, NamedTuple
+
+from src.toggl.rate_limit import RateLimiter
 
 from src.toggl.model import (
     TagData,
@@ -10,12 +16,34 @@ from src.toggl.model import (
     ClientData,
     ProjectData,
     SubscriptionData,
+    TimeEntryData,
     TimeEntryReportData,
 )
 
 
-class TogglApi:
+class ApiRequest(NamedTuple):
+    # Pagination styles of the toggl api
+    PAGINATION_PAGE = "page"
+    PAGINATION_ROW_NUMBER = "row_number"
+
+    method: str
+    endpoint: str
+    params: dict = None
+    json_body: dict = None
+    pagination: str = None
+
+
+class BaseTogglApi:
+    """
+    Endpoints and pagination of the toggl api, independent of the transport.
+    Every endpoint describes its requests and hands them to the _call,
+    _paginate and _collect methods of the sync or async subclass.
+    """
+
     MIN_YEAR = 2006
+    MAX_RETRIES = 5
+    # The since parameter only reaches back three months
+    MAX_SINCE_DAYS = 90
 
     def __init__(
         self,
@@ -28,171 +56,263 @@ class TogglApi:
         self.username = username
         self.password = password
         self.base_url = base_url
-        self.client = httpx.Client()
+        self.rate_limiter = RateLimiter.for_key(api_token or username)
 
     def get_me(
         self,
     ) -> MeData:
-        response_body = self.__simple_request(
-            "GET",
-            "/api/v9/me",
-        )
-        return MeData.from_dict(response_body)
+        return self._call(ApiRequest("GET", "/api/v9/me"), MeData.from_dict)
 
     def get_my_organizations(
         self,
     ) -> list[OrganizationData]:
-        response_body = self.__simple_request(
-            "GET",
-            "/api/v9/me/organizations",
+        return self._call(
+            ApiRequest("GET", "/api/v9/me/organizations"),
+            OrganizationData.from_dict_list,
         )
-        return OrganizationData.from_dict_list(response_body)
 
     def get_my_workspaces(
         self,
     ) -> list[WorkspaceData]:
-        response_body = self.__simple_request(
-            "GET",
-            "/api/v9/me/workspaces",
+        return self._call(
+            ApiRequest("GET", "/api/v9/me/workspaces"), WorkspaceData.from_dict_list
+        )
+
+    def get_my_time_entries_since(
+        self,
+        since: datetime,
+    ) -> list[TimeEntryData]:
+        return self._call(
+            ApiRequest(
+                "GET",
+                "/api/v9/me/time_entries",
+                params={"since": int(since.timestamp())},
+            ),
+            lambda body: TimeEntryData.from_dict_list(body or []),
         )
-        return WorkspaceData.from_dict_list(response_body)
 
     def get_workspace_clients(
         self,
         workspace_id: int,
     ) -> list[ClientData]:
-        response_body = (
-            self.__simple_request(
-                "GET",
-                f"/api/v9/workspaces/{workspace_id}/clients",
-            )
-            or []
+        return self._call(
+            ApiRequest("GET", f"/api/v9/workspaces/{workspace_id}/clients"),
+            lambda body: ClientData.from_dict_list(body or []),
         )
-        return ClientData.from_dict_list(response_body)
 
     def get_workspace_tags(
         self,
         workspace_id: int,
     ) -> list[TagData]:
-        response_body = (
-            self.__simple_request(
-                "GET",
-                f"/api/v9/workspaces/{workspace_id}/tags",
-            )
-            or []
+        return self._call(
+            ApiRequest("GET", f"/api/v9/workspaces/{workspace_id}/tags"),
+            lambda body: TagData.from_dict_list(body or []),
         )
-        return WorkspaceData.from_dict_list(response_body)
 
     def get_workspace_projects(
         self,
         workspace_id: int,
     ) -> list[ProjectData]:
-        response_body = self.__paginated_request(
-            "GET",
-            f"/api/v9/workspaces/{workspace_id}/projects",
+        return self._collect(self.iter_workspace_projects(workspace_id))
+
+    def iter_workspace_projects(
+        self,
+        workspace_id: int,
+    ) -> Iterator[list[ProjectData]] | AsyncIterator[list[ProjectData]]:
+        return self._paginate(
+            ApiRequest(
+                "GET",
+                f"/api/v9/workspaces/{workspace_id}/projects",
+                params={"page": 1},
+                pagination=ApiRequest.PAGINATION_PAGE,
+            ),
+            ProjectData.from_dict_list,
         )
-        return ProjectData.from_dict_list(response_body)
 
     def get_workspace_subscriptions(
         self,
         workspace_id: int,
     ) -> list[SubscriptionData]:
-        response_body = self.__simple_request(
-            "GET",
-            f"/webhooks/api/v1/subscriptions/{workspace_id}",
+        return self._call(
+            ApiRequest("GET", f"/webhooks/api/v1/subscriptions/{workspace_id}"),
+            SubscriptionData.from_dict_list,
         )
 
-        return SubscriptionData.from_dict_list(response_body)
-
     def create_workspace_subscription(
         self,
         workspace_id: int,
         subscription: SubscriptionData,
     ) -> None:
-        self.__simple_request(
-            "POST",
-            f"/webhooks/api/v1/subscriptions/{workspace_id}",
-            json_body=subscription.to_dict(),
+        return self._call(
+            ApiRequest(
+                "POST",
+                f"/webhooks/api/v1/subscriptions/{workspace_id}",
+                json_body=subscription.to_dict(),
+            ),
+            lambda _: None,
         )
 
     def get_workspace_time_entry_report_start_end(
         self, workspace_id: int, start_date: date, end_date: date
     ) -> list[TimeEntryReportData]:
-        request_body = {
-            "start_date": start_date.strftime("%Y-%m-%d"),
-            "end_date": end_date.strftime("%Y-%m-%d"),
-        }
-        response_body = self.__paginated_report_request(
-            "POST",
-            f"/reports/api/v3/workspace/{workspace_id}/search/time_entries",
-            request_body,
+        return self._collect(
+            self.iter_workspace_time_entry_report_start_end(
+                workspace_id, start_date, end_date
+            )
+        )
+
+    def iter_workspace_time_entry_report_start_end(
+        self, workspace_id: int, start_date: date, end_date: date
+    ) -> Iterator[list[TimeEntryReportData]] | AsyncIterator[list[TimeEntryReportData]]:
+        return self._paginate(
+            ApiRequest(
+                "POST",
+                f"/reports/api/v3/workspace/{workspace_id}/search/time_entries",
+                json_body={
+                    "start_date": start_date.strftime("%Y-%m-%d"),
+                    "end_date": end_date.strftime("%Y-%m-%d"),
+                },
+                pagination=ApiRequest.PAGINATION_ROW_NUMBER,
+            ),
+            TimeEntryReportData.from_dict_list,
         )
-        return TimeEntryReportData.from_dict_list(response_body)
 
-    def __http_request(
-        self, method: str, endpoint: str, params: dict = None, json_body: dict = None
-    ) -> httpx.Request:
-        if params is None:
-            params = {}
+    def _call(self, request: ApiRequest, parse: Callable[[Any], Any]):
+        raise NotImplementedError()
+
+    def _paginate(self, request: ApiRequest, parse: Callable[[list], list]):
+        raise NotImplementedError()
 
+    def _collect(self, pages):
+        raise NotImplementedError()
+
+    def _get_request_options(self, request: ApiRequest) -> dict:
         if self.api_token:
             auth = (self.api_token, "api_token")
         else:
             auth = (self.username, self.password)
 
-        response = self.client.request(
-            method=method,
-            params=params,
-            url=f"{self.base_url}{endpoint}",
-            json=json_body,
-            auth=auth,
-        )
-        response.raise_for_status()
-        time.sleep(0.5)
+        return {
+            "method": request.method,
+            "url": f"{self.base_url}{request.endpoint}",
+            "params": request.params or {},
+            "json": request.json_body,
+            "auth": auth,
+        }
+
+    def _get_page(
+        self, request: ApiRequest, response: httpx.Response
+    ) -> tuple[list | None, ApiRequest | None]:
+        """
+        Returns the page of a paginated response (None if there is none) and
+        the request for the next page (None after the last page).
+        """
+        body = response.json()
+        match request.pagination:
+            case ApiRequest.PAGINATION_PAGE:
+                if len(body) == 0:
+                    return None, None
+                params = {**request.params, "page": request.params["page"] + 1}
+                return body, request._replace(params=params)
+            case ApiRequest.PAGINATION_ROW_NUMBER:
+                if "x-next-row-number" not in response.headers:
+                    return body, None
+                json_body = {
+                    **request.json_body,
+                    "first_row_number": int(response.headers["x-next-row-number"]),
+                }
+                return body, request._replace(json_body=json_body)
+            case _:
+                return body, None
 
-        return response
 
-    def __simple_request(
-        self, method: str, endpoint: str, params: dict = None, json_body: dict = None
+class TogglApi(BaseTogglApi):
+    def __init__(
+        self,
+        api_token: str = None,
+        username: str = None,
+        password: str = None,
+        base_url: str = "https://api.track.toggl.com",
     ):
-        response = self.__http_request(
-            method, endpoint, params=params, json_body=json_body
-        )
+        super().__init__(api_token, username, password, base_url)
+        self.client = httpx.Client()
 
-        return response.json()
+    def _call(self, request: ApiRequest, parse: Callable[[Any], Any]):
+        return parse(self.__http_request(request).json())
 
-    def __paginated_request(self, method: str, endpoint: str, params: dict = None):
-        result = []
-        params = {} if params is None else params
-        params["page"] = 1
+    def _paginate(self, request: ApiRequest, parse: Callable[[list], list]):
+        while request is not None:
+            page, request = self._get_page(request, self.__http_request(request))
+            if page is not None:
+                yield parse(page)
 
-        while True:
-            response = self.__http_request(method, endpoint, params=params)
-            response_json = response.json()
+    def _collect(self, pages: Iterator[list]) -> list:
+        return list(chain.from_iterable(pages))
 
-            if len(response_json) == 0:
+    def __http_request(self, request: ApiRequest) -> httpx.Response:
+        for _ in range(self.MAX_RETRIES + 1):
+            time.sleep(self.rate_limiter.reserve())
+            response = self.client.request(**self._get_request_options(request))
+            if self.rate_limiter.update(response) is None:
                 break
+        response.raise_for_status()
 
-            result += response_json
-            params["page"] += 1
+        return response
 
-        return result
 
-    def __paginated_report_request(
-        self, method: str, endpoint: str, json_body: dict = None
+class AsyncTogglApi(BaseTogglApi):
+    """
+    Asynchronous variant of TogglApi, every endpoint returns an awaitable or
+    an async iterator. At most max_concurrent_requests requests are in flight
+    at the same time.
+    """
+
+    def __init__(
+        self,
+        api_token: str = None,
+        username: str = None,
+        password: str = None,
+        base_url: str = "https://api.track.toggl.com",
+        max_concurrent_requests: int = 4,
     ):
-        result = []
-        json_body = {} if json_body is None else json_body
+        super().__init__(api_token, username, password, base_url)
+        self.client = httpx.AsyncClient()
+        self.semaphore = asyncio.Semaphore(max_concurrent_requests)
 
-        while True:
-            response = self.__http_request(method, endpoint, json_body=json_body)
-            result += response.json()
+    async def __aenter__(self) -> "AsyncTogglApi":
+        return self
 
-            if "x-next-row-number" in response.headers:
-                json_body["first_row_number"] = int(
-                    response.headers["x-next-row-number"]
-                )
-            else:
-                break
+    async def __aexit__(self, *_args) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    async def _call(self, request: ApiRequest, parse: Callable[[Any], Any]):
+        return parse((await self.__http_request(request)).json())
 
+    async def _paginate(self, request: ApiRequest, parse: Callable[[list], list]):
+        while request is not None:
+            response = await self.__http_request(request)
+            page, request = self._get_page(request, response)
+            if page is not None:
+                yield parse(page)
+
+    async def _collect(self, pages: AsyncIterator[list]) -> list:
+        result = []
+        async for page in pages:
+            result += page
         return result
+
+    async def __http_request(self, request: ApiRequest) -> httpx.Response:
+        async with self.semaphore:
+            for _ in range(self.MAX_RETRIES + 1):
+                await asyncio.sleep(self.rate_limiter.reserve())
+                response = await self.client.request(
+                    **self._get_request_options(request)
+                )
+                if self.rate_limiter.update(response) is None:
+                    break
+        response.raise_for_status()
+
+        return response
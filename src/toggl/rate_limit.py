@@ -0,0 +1,156 @@
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from threading import Lock
+
+import httpx
+
+from src.util.lru_cache import LruCache
+
+
+class RateLimiter:
+    """
+    Token bucket that throttles the requests of a single api token.
+    It starts at the documented safe rate of one request per second and only
+    goes faster while the quota headers of the toggl api leave room for it.
+    Once few requests of the quota are left, the remaining ones are spread
+    until the quota resets. The rate is halved on every 429 response and
+    slowly recovers while requests succeed. An exhausted quota (402) blocks
+    until it resets.
+    https://developers.track.toggl.com/docs/#generic-considerations
+    """
+
+    QUOTA_REMAINING_HEADER = "x-toggl-quota-remaining"
+    QUOTA_RESETS_IN_HEADER = "x-toggl-quota-resets-in"
+    RETRY_AFTER_HEADER = "retry-after"
+
+    MIN_RATE = 0.5
+    SAFE_RATE = 1.0
+    # Only reached once the quota headers are known
+    MAX_RATE = 4.0
+    RATE_RECOVERY = 0.1
+    CAPACITY = 1
+    DEFAULT_BACKOFF = 1.0
+    MAX_BACKOFF = 60.0
+    # Remaining requests below which the quota limits the rate
+    QUOTA_LOW_WATER_MARK = 50
+    MAX_LIMITERS = 1024
+
+    __limiters = LruCache(MAX_LIMITERS)
+    __limiters_lock = Lock()
+
+    def __init__(self, rate: float = SAFE_RATE, capacity: int = CAPACITY) -> None:
+        self.rate = rate
+        self.quota_known = False
+        self.quota_rate = None
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.backoff_count = 0
+        self.lock = Lock()
+
+    @classmethod
+    def for_key(cls, key: str) -> "RateLimiter":
+        with cls.__limiters_lock:
+            limiter = cls.__limiters.get(key)
+            if limiter is None:
+                limiter = cls()
+                cls.__limiters.put(key, limiter)
+            return limiter
+
+    def reserve(self) -> float:
+        """
+        Takes a token from the bucket and returns the number of seconds the
+        caller has to wait before sending its request.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.__refill(now)
+            self.tokens -= 1
+
+            wait = -self.tokens / self.__effective_rate() if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def update(self, response: httpx.Response) -> float | None:
+        """
+        Adapts the bucket to the rate limit headers of a response. Returns the
+        number of seconds to wait before a retry if the request was throttled.
+        """
+        with self.lock:
+            now = time.monotonic()
+
+            remaining = self.__header_float(response, self.QUOTA_REMAINING_HEADER)
+            resets_in = self.__header_float(response, self.QUOTA_RESETS_IN_HEADER)
+            if remaining is not None and resets_in is not None:
+                self.quota_known = True
+                self.quota_rate = (
+                    remaining / max(resets_in, 1.0)
+                    if remaining < self.QUOTA_LOW_WATER_MARK
+                    else None
+                )
+
+            if (
+                response.status_code == httpx.codes.PAYMENT_REQUIRED
+                and resets_in is not None
+            ):
+                # the quota of the current period is used up
+                self.blocked_until = max(self.blocked_until, now + resets_in)
+                self.tokens = min(self.tokens, 0.0)
+                return resets_in
+
+            if response.status_code != httpx.codes.TOO_MANY_REQUESTS:
+                self.backoff_count = 0
+                max_rate = self.MAX_RATE if self.quota_known else self.SAFE_RATE
+                self.rate = min(max_rate, self.rate + self.RATE_RECOVERY)
+                return None
+
+            self.backoff_count += 1
+            self.rate = max(self.MIN_RATE, self.rate / 2)
+            retry_after = self.__retry_after(response)
+            if retry_after is None:
+                retry_after = min(
+                    self.DEFAULT_BACKOFF * 2 ** (self.backoff_count - 1),
+                    self.MAX_BACKOFF,
+                )
+
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+            self.tokens = min(self.tokens, 0.0)
+
+            return retry_after
+
+    def __refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        self.tokens = min(
+            float(self.capacity), self.tokens + elapsed * self.__effective_rate()
+        )
+        self.updated_at = now
+
+    def __effective_rate(self) -> float:
+        if self.quota_rate is None:
+            return self.rate
+        return max(min(self.rate, self.quota_rate), self.MIN_RATE / 10)
+
+    @classmethod
+    def __header_float(cls, response: httpx.Response, name: str) -> float | None:
+        try:
+            return float(response.headers[name])
+        except (KeyError, ValueError):
+            return None
+
+    @classmethod
+    def __retry_after(cls, response: httpx.Response) -> float | None:
+        value = response.headers.get(cls.RETRY_AFTER_HEADER)
+        if value is None:
+            return None
+
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
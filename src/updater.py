@@ -1,13 +1,16 @@
 from threading import Event as ThreadingEvent
+import asyncio
 import logging
 import signal
-from datetime import date, datetime, timezone
+from datetime import date, datetime, timedelta, timezone
 from flask import Flask
+import httpx
 
-from src.toggl.api import TogglApi
-from src.toggl.model import SubscriptionData, EventFilterData
+from src.toggl.api import TogglApi, AsyncTogglApi
+from src.toggl.model import SubscriptionData, EventFilterData, TimeEntryData
 from src.db.entity import (
     User,
+    UserWorkspace,
     Client,
     Tag,
     Project,
@@ -16,6 +19,8 @@ from src.db.entity import (
     Organization,
     Schedule,
     Event,
+    DailyTotal,
+    HeatmapCounter,
 )
 from src.schedule import CalendarSync
 
@@ -27,12 +32,16 @@ class Updater:
         sync_interval_toggl: int,
         flask: Flask,
         server_id: str,
+        toggl_max_concurrent_requests: int = 4,
+        full_sync_interval_toggl: int = 604800,
     ) -> None:
         self.exit_event = ThreadingEvent()
         self.sync_interval_calendar = sync_interval_calendar
         self.sync_interval_toggl = sync_interval_toggl
         self.flask = flask
         self.server_id = server_id
+        self.toggl_max_concurrent_requests = toggl_max_concurrent_requests
+        self.full_sync_interval_toggl = full_sync_interval_toggl
         exit_signals = {1: "SIGHUP", 2: "SIGINT", 15: "SIGTERM"}
 
         def exit_loop(signal_number, _frame):
@@ -59,17 +68,23 @@ class Updater:
 
         if len(users) > 0:
             users_updated = 0
-            organizations_created_updated = 0
+            organizations_created = 0
+            organizations_updated = 0
             organizations_deleted = 0
-            workspaces_created_updated = 0
+            workspaces_created = 0
+            workspaces_updated = 0
             workspaces_deleted = 0
-            time_entries_created_updated = 0
+            time_entries_created = 0
+            time_entries_updated = 0
             time_entries_deleted = 0
-            clients_created_updated = 0
+            clients_created = 0
+            clients_updated = 0
             clients_deleted = 0
-            projects_created_updated = 0
+            projects_created = 0
+            projects_updated = 0
             projects_deleted = 0
-            tags_created_updated = 0
+            tags_created = 0
+            tags_updated = 0
             tags_deleted = 0
 
             for user in users:
@@ -84,25 +99,73 @@ class Updater:
 
                 # create/update organizations
                 organization_dataset = toggl_api.get_my_organizations()
-                for organization_data in organization_dataset:
-                    Organization.create_or_update_via_api_data(organization_data)
-                organizations_created_updated += len(organization_dataset)
+                created, updated = Organization.bulk_create_or_update_via_api_data(
+                    organization_dataset
+                )
+                organizations_created += created
+                organizations_updated += updated
 
                 # create/update workspaces
                 workspace_dataset = toggl_api.get_my_workspaces()
-                workspaces = []
-                for workspace_data in workspace_dataset:
-                    workspaces.append(
-                        Workspace.create_or_update_via_api_data(workspace_data)
+                created, updated = Workspace.bulk_create_or_update_via_api_data(
+                    workspace_dataset
+                )
+                workspaces_created += created
+                workspaces_updated += updated
+                workspaces = list(
+                    Workspace.objects(
+                        workspace_id__in=[wd.id for wd in workspace_dataset]
                     )
+                )
                 user = User.update_workspaces_via_api_data(user, workspace_dataset)
-                workspaces_created_updated += len(workspaces)
+
+                # decide which workspaces need a full time entry rescan
+                sync_started_at = datetime.now(timezone.utc)
+                user_workspaces = {
+                    uw.workspace.workspace_id: uw for uw in user.workspaces
+                }
+                full_sync_workspace_ids = set()
+                for workspace in workspaces:
+                    if self.needs_full_time_entry_sync(
+                        user_workspaces[workspace.workspace_id], sync_started_at
+                    ):
+                        full_sync_workspace_ids.add(workspace.workspace_id)
+                incremental_cursors = [
+                    user_workspaces[w.workspace_id].time_entries_synced_at
+                    for w in workspaces
+                    if w.workspace_id not in full_sync_workspace_ids
+                ]
+                since = min(incremental_cursors) if incremental_cursors else None
+
+                # bound time entry range queries before entries are stored, so
+                # the maximum is raised with every page of a rescan
+                for workspace in workspaces:
+                    if workspace.max_time_entry_duration is None:
+                        workspace.max_time_entry_duration = (
+                            Workspace.rebuild_max_time_entry_duration(
+                                workspace.workspace_id
+                            )
+                        )
+
+                # fetch workspace data and run full rescans concurrently
+                (
+                    workspace_datasets,
+                    modified_time_entry_dataset,
+                    time_entry_reports,
+                ) = asyncio.run(
+                    self.fetch_workspace_datasets(
+                        user.api_token,
+                        [w.workspace_id for w in workspaces],
+                        since,
+                        full_sync_workspace_ids,
+                    )
+                )
 
                 for user_workspace in user.workspaces:
                     # get existing webhooks
-                    subscriptions = toggl_api.get_workspace_subscriptions(
+                    subscriptions = workspace_datasets[
                         user_workspace.workspace.workspace_id
-                    )
+                    ][0]
 
                     # prepare data for new webhook
                     webhook_description = f"ttc/{self.server_id}/{user.user_id}"
@@ -137,59 +200,104 @@ class Updater:
                             user_workspace.workspace.workspace_id, new_webhook
                         )
 
+                changed_workspace_ids = set()
                 for workspace in workspaces:
+                    changes = 0
+                    (
+                        _,
+                        client_dataset,
+                        project_dataset,
+                        tag_dataset,
+                    ) = workspace_datasets[workspace.workspace_id]
+
                     # create/update clients
-                    client_dataset = toggl_api.get_workspace_clients(
-                        workspace.workspace_id
+                    created, updated = Client.bulk_create_or_update_via_api_data(
+                        client_dataset
                     )
-                    for client_data in client_dataset:
-                        Client.create_or_update_via_api_data(client_data)
-                    clients_created_updated = len(client_dataset)
+                    clients_created += created
+                    clients_updated += updated
+                    changes += created + updated
 
                     # create/update projects
-                    project_dataset = toggl_api.get_workspace_projects(
-                        workspace.workspace_id
+                    created, updated = Project.bulk_create_or_update_via_api_data(
+                        project_dataset
                     )
-                    for project_data in project_dataset:
-                        Project.create_or_update_via_api_data(project_data)
-
-                    projects_created_updated = len(project_dataset)
+                    projects_created += created
+                    projects_updated += updated
+                    changes += created + updated
 
                     # create/update tags
-                    tag_dataset = toggl_api.get_workspace_tags(workspace.workspace_id)
-                    for tag_data in tag_dataset:
-                        Tag.create_or_update_via_api_data(tag_data)
-                    tags_created_updated += len(tag_dataset)
-
-                    # create/update time entries
-                    time_entry_dataset = []
-                    for year in range(TogglApi.MIN_YEAR, date.today().year + 1):
-                        start_date = date(year, 1, 1)
-                        end_date = date(year, 12, 31)
-
-                        time_entry_dataset += (
-                            toggl_api.get_workspace_time_entry_report_start_end(
-                                workspace.workspace_id, start_date, end_date
+                    created, updated = Tag.bulk_create_or_update_via_api_data(
+                        tag_dataset
+                    )
+                    tags_created += created
+                    tags_updated += updated
+                    changes += created + updated
+
+                    user_workspace = user_workspaces[workspace.workspace_id]
+                    if workspace.workspace_id in full_sync_workspace_ids:
+                        # time entries were stored page by page (full rescan)
+                        created, updated, remote_time_entry_ids = time_entry_reports[
+                            workspace.workspace_id
+                        ]
+                        time_entries_created += created
+                        time_entries_updated += updated
+                        changes += created + updated
+
+                        # delete time entries
+                        local_time_entry_ids = set(
+                            TimeEntry.objects(workspace=workspace).scalar(
+                                "time_entry_id"
+                            )
+                        )
+                        time_entry_ids_to_delete = (
+                            local_time_entry_ids - remote_time_entry_ids
+                        )
+                        deleted = TimeEntry.delete_via_ids(time_entry_ids_to_delete)
+                        time_entries_deleted += deleted
+                        changes += deleted
+
+                        user_workspace.time_entries_full_synced_at = sync_started_at
+                    else:
+                        # create/update time entries (modified since last sync)
+                        workspace_modified_dataset = list(
+                            filter(
+                                lambda d: d.workspace_id == workspace.workspace_id,
+                                modified_time_entry_dataset,
+                            )
+                        )
+                        created, updated = TimeEntry.bulk_create_or_update_via_api_data(
+                            list(
+                                filter(
+                                    lambda d: d.server_deleted_at is None,
+                                    workspace_modified_dataset,
+                                )
                             )
                         )
-                    for time_entry_data in time_entry_dataset:
-                        TimeEntry.create_or_update_via_report_api_data(
-                            time_entry_data, workspace.workspace_id
+                        time_entries_created += created
+                        time_entries_updated += updated
+                        changes += created + updated
+                        time_entry_ids_to_delete = set(
+                            d.id
+                            for d in workspace_modified_dataset
+                            if d.server_deleted_at is not None
                         )
-                    time_entries_created_updated += len(time_entry_dataset)
 
-                    # delete time entries
-                    remote_time_entry_ids = set(
-                        map(lambda d: d.time_entries[0].id, time_entry_dataset)
-                    )
-                    local_time_entry_ids = set(
-                        TimeEntry.objects(workspace=workspace).scalar("time_entry_id")
-                    )
-                    time_entry_ids_to_delete = (
-                        local_time_entry_ids - remote_time_entry_ids
-                    )
-                    TimeEntry.delete_via_ids(time_entry_ids_to_delete)
-                    time_entries_deleted += len(time_entry_ids_to_delete)
+                        # delete time entries
+                        deleted = TimeEntry.delete_via_ids(time_entry_ids_to_delete)
+                        time_entries_deleted += deleted
+                        changes += deleted
+
+                    user_workspace.time_entries_synced_at = sync_started_at
+
+                    # rebuild daily totals if the timezone of the user changed
+                    if user_workspace.daily_totals_timezone != user.timezone:
+                        DailyTotal.rebuild(user, workspace)
+                        changes += 1
+
+                    # rebuild heatmap if timezone or start of aggregation changed
+                    if HeatmapCounter.get_valid(user, workspace) is None:
+                        HeatmapCounter.rebuild(user, workspace)
 
                     # delete tags
                     remote_tag_ids = set(map(lambda d: d.id, tag_dataset))
@@ -197,8 +305,9 @@ class Updater:
                         Tag.objects(workspace=workspace).scalar("tag_id")
                     )
                     tag_ids_to_delete = local_tag_ids - remote_tag_ids
-                    Tag.delete_via_ids(tag_ids_to_delete)
-                    tags_deleted += len(tag_ids_to_delete)
+                    deleted = Tag.delete_via_ids(tag_ids_to_delete)
+                    tags_deleted += deleted
+                    changes += deleted
 
                     # delete projects
                     remote_project_ids = set(map(lambda d: d.id, project_dataset))
@@ -206,8 +315,9 @@ class Updater:
                         Project.objects(workspace=workspace).scalar("project_id")
                     )
                     project_ids_to_delete = local_project_ids - remote_project_ids
-                    Project.delete_via_ids(project_ids_to_delete)
-                    projects_deleted += len(project_ids_to_delete)
+                    deleted = Project.delete_via_ids(project_ids_to_delete)
+                    projects_deleted += deleted
+                    changes += deleted
 
                     # delete clients
                     remote_client_ids = set(map(lambda d: d.id, client_dataset))
@@ -215,8 +325,19 @@ class Updater:
                         Client.objects(workspace=workspace).scalar("client_id")
                     )
                     client_ids_to_delete = local_client_ids - remote_client_ids
-                    Client.delete_via_ids(client_ids_to_delete)
-                    clients_deleted += len(client_ids_to_delete)
+                    deleted = Client.delete_via_ids(client_ids_to_delete)
+                    clients_deleted += deleted
+                    changes += deleted
+
+                    if changes > 0:
+                        changed_workspace_ids.add(workspace.workspace_id)
+
+                # store time entry sync cursors
+                user.save()
+
+                # invalidate cached reports of all users of changed workspaces
+                for workspace_id in changed_workspace_ids:
+                    User.bump_data_version(workspace_id)
 
             # delete workspaces
             used_workspace_ids = set()
@@ -227,8 +348,7 @@ class Updater:
                 )
             all_workspace_ids = set(Workspace.objects().scalar("workspace_id"))
             workspace_ids_to_delete = all_workspace_ids - used_workspace_ids
-            Workspace.delete_via_ids(workspace_ids_to_delete)
-            workspaces_deleted += len(workspace_ids_to_delete)
+            workspaces_deleted += Workspace.delete_via_ids(workspace_ids_to_delete)
 
             # delete organizations
             used_organization_ids = set()
@@ -239,42 +359,173 @@ class Updater:
                 )
             all_organization_ids = set(Organization.objects().scalar("organization_id"))
             organization_ids_to_delete = all_organization_ids - used_organization_ids
-            Organization.delete_via_ids(organization_ids_to_delete)
-            organizations_deleted += len(organization_ids_to_delete)
+            organizations_deleted += Organization.delete_via_ids(
+                organization_ids_to_delete
+            )
 
             # log some sync stats
             logging.info("Users updated: %i", users_updated)
             logging.info(
-                "Organizations created/updated: %i; deleted: %i",
-                organizations_created_updated,
+                "Organizations created: %i; updated: %i; deleted: %i",
+                organizations_created,
+                organizations_updated,
                 organizations_deleted,
             )
             logging.info(
-                "Workspaces created/updated: %i; deleted: %i",
-                workspaces_created_updated,
+                "Workspaces created: %i; updated: %i; deleted: %i",
+                workspaces_created,
+                workspaces_updated,
                 workspaces_deleted,
             )
             logging.info(
-                "Clients created/updated: %i; deleted: %i",
-                clients_created_updated,
+                "Clients created: %i; updated: %i; deleted: %i",
+                clients_created,
+                clients_updated,
                 clients_deleted,
             )
             logging.info(
-                "Projects created/updated: %i; deleted: %i",
-                projects_created_updated,
+                "Projects created: %i; updated: %i; deleted: %i",
+                projects_created,
+                projects_updated,
                 projects_deleted,
             )
             logging.info(
-                "Tags created/updated: %i; deleted: %i",
-                tags_created_updated,
+                "Tags created: %i; updated: %i; deleted: %i",
+                tags_created,
+                tags_updated,
                 tags_deleted,
             )
             logging.info(
-                "Time entries created/updated: %i; deleted %i",
-                time_entries_created_updated,
+                "Time entries created: %i; updated: %i; deleted %i",
+                time_entries_created,
+                time_entries_updated,
                 time_entries_deleted,
             )
 
+    def needs_full_time_entry_sync(
+        self, user_workspace: UserWorkspace, now: datetime
+    ) -> bool:
+        synced_at = user_workspace.time_entries_synced_at
+        full_synced_at = user_workspace.time_entries_full_synced_at
+        if synced_at is None or full_synced_at is None:
+            return True
+
+        full_sync_due = now - full_synced_at >= timedelta(
+            seconds=self.full_sync_interval_toggl
+        )
+        cursor_expired = now - synced_at >= timedelta(days=TogglApi.MAX_SINCE_DAYS)
+
+        return full_sync_due or cursor_expired
+
+    async def fetch_workspace_datasets(
+        self,
+        api_token: str,
+        workspace_ids: list[int],
+        since: datetime | None,
+        full_sync_workspace_ids: set[int],
+    ) -> tuple[dict[int, tuple], list[TimeEntryData], dict[int, tuple]]:
+        """
+        Fetches the workspace data and the modified time entries, and rescans
+        the time entry reports of the given workspaces, all in one event loop.
+        Report pages are stored by a single consumer in a worker thread, so
+        the blocking writes never stall the requests in flight.
+        """
+        async with AsyncTogglApi(
+            api_token=api_token,
+            max_concurrent_requests=self.toggl_max_concurrent_requests,
+        ) as toggl_api:
+            # bounded, so only a few pages wait in memory to be stored
+            pages = asyncio.Queue(maxsize=self.toggl_max_concurrent_requests)
+
+            coroutines = [
+                self.fetch_workspace_dataset(toggl_api, workspace_id)
+                for workspace_id in workspace_ids
+            ]
+            if since is not None:
+                coroutines.append(toggl_api.get_my_time_entries_since(since))
+
+            # a failing task cancels all others, so no fetcher waits forever
+            # for a consumer that stopped reading the queue
+            try:
+                async with asyncio.TaskGroup() as task_group:
+                    store_task = task_group.create_task(
+                        self.store_time_entry_reports(pages, full_sync_workspace_ids)
+                    )
+                    tasks = [task_group.create_task(c) for c in coroutines]
+                    report_tasks = [
+                        task_group.create_task(
+                            self.sync_time_entry_report(
+                                toggl_api, pages, workspace_id, year
+                            )
+                        )
+                        for workspace_id in full_sync_workspace_ids
+                        for year in range(AsyncTogglApi.MIN_YEAR, date.today().year + 1)
+                    ]
+
+                    # all pages are queued once the report tasks are done
+                    if len(report_tasks) > 0:
+                        await asyncio.wait(report_tasks)
+                    await pages.put(None)
+            except ExceptionGroup as e:
+                raise e.exceptions[0]
+            results = [task.result() for task in tasks]
+            time_entry_reports = store_task.result()
+
+        datasets = dict(zip(workspace_ids, results))
+        modified_time_entry_dataset = results[-1] if since is not None else []
+
+        return datasets, modified_time_entry_dataset, time_entry_reports
+
+    async def fetch_workspace_dataset(
+        self, toggl_api: AsyncTogglApi, workspace_id: int
+    ) -> tuple:
+        return await asyncio.gather(
+            toggl_api.get_workspace_subscriptions(workspace_id),
+            toggl_api.get_workspace_clients(workspace_id),
+            toggl_api.get_workspace_projects(workspace_id),
+            toggl_api.get_workspace_tags(workspace_id),
+        )
+
+    async def sync_time_entry_report(
+        self,
+        toggl_api: AsyncTogglApi,
+        pages: asyncio.Queue,
+        workspace_id: int,
+        year: int,
+    ) -> None:
+        year_pages = toggl_api.iter_workspace_time_entry_report_start_end(
+            workspace_id, date(year, 1, 1), date(year, 12, 31)
+        )
+        async for time_entry_dataset in year_pages:
+            await pages.put((workspace_id, time_entry_dataset))
+
+    async def store_time_entry_reports(
+        self, pages: asyncio.Queue, workspace_ids: set[int]
+    ) -> dict[int, tuple[int, int, set[int]]]:
+        """
+        Stores report pages until None is received. Returns created, updated
+        and the ids of all remote time entries per workspace.
+        """
+        results = {workspace_id: (0, 0, set()) for workspace_id in workspace_ids}
+        while (page := await pages.get()) is not None:
+            workspace_id, time_entry_dataset = page
+            page_created, page_updated = await asyncio.to_thread(
+                TimeEntry.bulk_create_or_update_via_report_api_data,
+                time_entry_dataset,
+                workspace_id,
+            )
+            created, updated, remote_time_entry_ids = results[workspace_id]
+            remote_time_entry_ids.update(
+                d.time_entries[0].id for d in time_entry_dataset
+            )
+            results[workspace_id] = (
+                created + page_created,
+                updated + page_updated,
+                remote_time_entry_ids,
+            )
+
+        return results
+
     def sync_calendars(self):
         users = User.objects(next_calendar_sync_at__lte=datetime.now(timezone.utc))
         logging.info("Found %s users to sync with calendars", len(users))
@@ -296,11 +547,27 @@ class Updater:
                             user, self.sync_interval_calendar, is_calendar_sync=True
                         )
 
-                        # process ical file
+                        # process ical file, unless it did not change
                         workspace = user_workspace.workspace
-                        ical = cal_sync.fetch_calendar(
-                            user_workspace.schedule_calendar_url
-                        )
+                        try:
+                            ical = cal_sync.fetch_calendar(user_workspace)
+                        except (ValueError, httpx.HTTPError) as e:
+                            logging.warning(
+                                "Skip calendar of user %i in workspace %i: %s",
+                                user.user_id,
+                                workspace.workspace_id,
+                                e,
+                            )
+                            continue
+                        if ical is None:
+                            logging.debug(
+                                "Calendar of user %i in workspace %i is unchanged",
+                                user.user_id,
+                                workspace.workspace_id,
+                            )
+                            # store validators renewed by an unchanged body
+                            user.save()
+                            continue
                         components = cal_sync.filter_ical_components(ical)
 
                         # prepare schedules
@@ -371,6 +638,12 @@ class Updater:
                             events[event_uid].delete()
                         events_deleted += len(events_to_delete)
 
+                        # invalidate cached reports
+                        User.bump_data_version(workspace.workspace_id, user.user_id)
+
+                        # store the validators of the processed calendar
+                        user.save()
+
             # log some sync stats
             logging.info(
                 "Schedules created: %i; updated: %i; deleted %i",
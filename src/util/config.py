@@ -16,6 +16,15 @@ class Config:
         self.flask_session_secret = values.get("FLASK_SESSION_SECRET")
         self.sync_interval_calendar = int(values.get("SYNC_INTERVAL_CALENDAR", 3600))
         self.sync_interval_toggl = int(values.get("SYNC_INTERVAL_TOGGL", 86400))
+        self.full_sync_interval_toggl = int(
+            values.get("FULL_SYNC_INTERVAL_TOGGL", 604800)
+        )
+        self.toggl_max_concurrent_requests = int(
+            values.get("TOGGL_MAX_CONCURRENT_REQUESTS", 4)
+        )
+        self.report_engine = values.get("REPORT_ENGINE", "aggregation")
+        self.report_cache_size = int(values.get("REPORT_CACHE_SIZE", 128))
+        self.report_cache_ttl = int(values.get("REPORT_CACHE_TTL", 900))
         self.log_level = values.get("LOG_LEVEL", "INFO")
 
         if self.server_id is None:
@@ -0,0 +1,66 @@
+import re
+
+
+class IcsFilter:
+    """
+    Line based pre-filter for raw ICS data. Keeps the calendar properties,
+    all timezone definitions and only those events whose unfolded content
+    contains the marker, so that only the relevant part of a large calendar
+    has to be parsed.
+    """
+
+    FOLDING_PATTERN = re.compile(rb"\r?\n[ \t]")
+
+    def __init__(self, marker: bytes) -> None:
+        self.marker = marker
+        self.lines = []
+        self.component = None
+        self.component_lines = []
+        self.depth = 0
+        self.buffer = b""
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Processes a chunk of raw data. Chunks may end in the middle of a line.
+        """
+        lines = (self.buffer + chunk).split(b"\n")
+        self.buffer = lines.pop()
+        for line in lines:
+            self.__feed_line(line)
+
+    def close(self) -> bytes:
+        """
+        Processes the remaining data and returns the filtered calendar.
+        """
+        if len(self.buffer) > 0:
+            self.__feed_line(self.buffer)
+            self.buffer = b""
+
+        return b"\n".join(self.lines)
+
+    def __feed_line(self, line: bytes) -> None:
+        name = line.rstrip(b"\r").upper()
+        if name.startswith(b"BEGIN:"):
+            self.depth += 1
+            if self.depth == 2:
+                # top level component of the calendar
+                self.component = name[6:]
+        elif name.startswith(b"END:"):
+            self.depth -= 1
+
+        if self.component is None:
+            self.lines.append(line)
+            return
+
+        self.component_lines.append(line)
+        if self.depth == 1:
+            if self.component == b"VTIMEZONE" or (
+                self.component == b"VEVENT" and self.__contains_marker()
+            ):
+                self.lines.extend(self.component_lines)
+            self.component = None
+            self.component_lines = []
+
+    def __contains_marker(self) -> bool:
+        content = b"\n".join(self.component_lines)
+        return self.marker in self.FOLDING_PATTERN.sub(b"", content)
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from threading import Lock
+import time
+from typing import Any
+
+
+class LruCache:
+    """
+    Thread safe mapping that evicts the least recently used entries once
+    their total size exceeds max_size. The size of an entry is 1, or the
+    result of get_size for its value if given. If ttl is given, entries expire
+    after ttl seconds.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float = None,
+        get_size: Callable[[Any], int] = None,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.get_size = get_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value, expires_at, _ = self.entries[key]
+            if expires_at is not None and expires_at <= time.monotonic():
+                self.__remove(key)
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        size = 1 if self.get_size is None else self.get_size(value)
+        with self.lock:
+            if key in self.entries:
+                self.__remove(key)
+            self.entries[key] = (value, expires_at, size)
+            self.size += size
+            while self.size > self.max_size:
+                self.__remove(next(iter(self.entries)))
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        Removes all entries whose key matches the predicate.
+        """
+        with self.lock:
+            keys = list(filter(predicate, self.entries.keys()))
+            for key in keys:
+                self.__remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def __remove(self, key: Hashable) -> None:
+        _, _, size = self.entries.pop(key)
+        self.size -= size
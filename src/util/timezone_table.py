@@ -0,0 +1,107 @@
+from bisect import bisect_right
+from datetime import date, datetime, timezone
+from threading import Lock
+
+from pytz import timezone as pytz_timezone
+from pytz.tzinfo import BaseTzInfo
+
+
+class TimezoneTable:
+    """
+    UTC offsets of a timezone as a sorted table of transitions. Converts unix
+    timestamps to local days (date ordinals) with bisect and integer
+    arithmetic instead of creating timezone aware datetimes.
+    """
+
+    DAY_SECONDS = 24 * 60 * 60
+    EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+    # 1970-01-01 was a thursday
+    EPOCH_WEEKDAY = 3
+
+    __tables = {}
+    __tables_lock = Lock()
+
+    def __init__(self, tz: BaseTzInfo) -> None:
+        epoch = datetime(1970, 1, 1)
+        transition_times = getattr(tz, "_utc_transition_times", None)
+        if transition_times:
+            self.transitions = [(t - epoch).total_seconds() for t in transition_times]
+            self.offsets = [
+                int(utcoffset.total_seconds())
+                for utcoffset, _, _ in getattr(tz, "_transition_info")
+            ]
+        else:
+            # timezones without transitions, e.g. UTC
+            self.transitions = [float("-inf")]
+            self.offsets = [int(tz.utcoffset(epoch).total_seconds())]
+        self.midnights = {}
+
+    @classmethod
+    def for_name(cls, name: str) -> "TimezoneTable":
+        with cls.__tables_lock:
+            if name not in cls.__tables:
+                cls.__tables[name] = cls(pytz_timezone(name))
+            return cls.__tables[name]
+
+    def offset_at(self, seconds: float) -> int:
+        return self.offsets[max(bisect_right(self.transitions, seconds) - 1, 0)]
+
+    def local_seconds(self, seconds: float) -> float:
+        return seconds + self.offset_at(seconds)
+
+    def local_day(self, seconds: float) -> int:
+        return int(self.local_seconds(seconds) // self.DAY_SECONDS) + self.EPOCH_ORDINAL
+
+    def local_weekday(self, day: int) -> int:
+        return (day - self.EPOCH_ORDINAL + self.EPOCH_WEEKDAY) % 7
+
+    def midnight_seconds(self, day: int) -> float:
+        """
+        Returns the unix timestamp at which the given local day starts.
+        """
+        if day not in self.midnights:
+            local = (day - self.EPOCH_ORDINAL) * self.DAY_SECONDS
+            offset_before = self.offset_at(local - self.DAY_SECONDS)
+            offset_after = self.offset_at(local + self.DAY_SECONDS)
+            for offset in (offset_before, offset_after):
+                if self.local_seconds(local - offset) == local:
+                    midnight = local - offset
+                    break
+            else:
+                # midnight is skipped by a transition, the day starts with it
+                index = bisect_right(self.transitions, local - offset_before) - 1
+                midnight = self.transitions[index]
+            self.midnights[day] = midnight
+
+        return self.midnights[day]
+
+    def local_midnight(self, day_date: date) -> datetime:
+        seconds = self.midnight_seconds(day_date.toordinal())
+        return datetime.fromtimestamp(seconds, timezone.utc)
+
+    def slice(self, started_at: float, stopped_at: float) -> list[tuple[int, float]]:
+        """
+        Splits an interval of unix timestamps at every local midnight.
+        Returns a list of (local day, duration in seconds) tuples.
+        """
+        day = self.local_day(started_at)
+        last_day = self.local_day(stopped_at)
+
+        slices = []
+        while day < last_day:
+            next_midnight = self.midnight_seconds(day + 1)
+            slices.append((day, next_midnight - started_at))
+            started_at = next_midnight
+            day += 1
+        slices.append((day, stopped_at - started_at))
+
+        return slices
+
+    def transitions_between(self, started_at: float, stopped_at: float) -> list[float]:
+        """
+        Returns all transitions after started_at up to stopped_at (inclusive).
+        """
+        start = bisect_right(self.transitions, started_at)
+        end = bisect_right(self.transitions, stopped_at, lo=start)
+
+        return self.transitions[start:end]
@@ -0,0 +1,79 @@
+from datetime import datetime
+from itertools import accumulate
+import math
+
+from src.util.timezone_table import TimezoneTable
+
+
+class WeekMinutes:
+    """
+    Counts time intervals per local minute of the week (monday 00:00 is 0).
+    Intervals are collected as +weight/-weight markers at the first and behind
+    the last minute, a cumulative sum turns them into counts.
+    """
+
+    DAY_MINUTES = 24 * 60
+    WEEK_MINUTES = 7 * DAY_MINUTES
+
+    @classmethod
+    def create_markers(cls) -> list[int]:
+        return [0] * (cls.WEEK_MINUTES + 1)
+
+    @classmethod
+    def to_counts(cls, markers: list[int]) -> list[int]:
+        return list(accumulate(markers[:-1]))
+
+    @classmethod
+    def add_interval(
+        cls,
+        markers: list[int],
+        started_at: datetime,
+        stopped_at: datetime,
+        timezone_table: TimezoneTable,
+        weight: int = 1,
+    ) -> None:
+        """
+        Counts every full minute from started_at to stopped_at (inclusive) at
+        its local minute of the week.
+        """
+        start = started_at.timestamp()
+        sample_count = int((stopped_at.timestamp() - start) // 60) + 1
+        if sample_count <= 0:
+            return
+
+        # split into runs of samples with the same utc offset
+        last_sample = start + (sample_count - 1) * 60
+        run_starts = [0]
+        for transition in timezone_table.transitions_between(start, last_sample):
+            run_starts.append(math.ceil((transition - start) / 60))
+
+        for run_start, run_end in zip(run_starts, run_starts[1:] + [sample_count]):
+            if run_start >= run_end:
+                continue
+            local = timezone_table.local_seconds(start + run_start * 60)
+            day = int(local // TimezoneTable.DAY_SECONDS) + TimezoneTable.EPOCH_ORDINAL
+            minute = int(local % TimezoneTable.DAY_SECONDS // 60)
+            cls.__add_run(
+                markers,
+                timezone_table.local_weekday(day) * cls.DAY_MINUTES + minute,
+                run_end - run_start,
+                weight,
+            )
+
+    @classmethod
+    def __add_run(
+        cls, markers: list[int], start: int, length: int, weight: int
+    ) -> None:
+        full_weeks, length = divmod(length, cls.WEEK_MINUTES)
+        markers[0] += full_weeks * weight
+        markers[cls.WEEK_MINUTES] -= full_weeks * weight
+
+        end = start + length
+        markers[start] += weight
+        if end <= cls.WEEK_MINUTES:
+            markers[end] -= weight
+        else:
+            # wraps around from sunday to monday
+            markers[cls.WEEK_MINUTES] -= weight
+            markers[0] += weight
+            markers[end - cls.WEEK_MINUTES] -= weight
@@ -1,10 +1,15 @@
 from flask import Response, render_template, session
 
 from src.db.entity import User
+from src.db.reference_cache import ReferenceCache
 
 
 class Index:
     def index(self) -> Response | str:
         user = User.objects.get(user_id=session["user_id"])
+        ReferenceCache.prefetch(user.workspaces, "workspace")
+        ReferenceCache.prefetch(
+            [uw.workspace for uw in user.workspaces], "organization"
+        )
 
         return render_template("index.html.j2", user=user)
@@ -3,18 +3,21 @@ from datetime import datetime
 
 from src.toggl.api import TogglApi
 from src.db.entity import Workspace, User
+from src.db.reference_cache import ReferenceCache
 from src.schedule import CalendarSync
 
 
 class Profile:
     def profile(self) -> Response | str:
         user = User.objects.get(user_id=session["user_id"])
+        ReferenceCache.prefetch(user.workspaces, "workspace")
 
         if request.method == "POST":
+            cal_sync = CalendarSync()
             for key, value in request.form.items():
                 workspace_id, name = key.split("-", 1)
 
-                workspace = Workspace.objects.get(workspace_id=workspace_id)
+                workspace = ReferenceCache.get(Workspace, int(workspace_id))
                 user_workspace = user.workspaces.get(workspace=workspace)
 
                 match name:
@@ -24,11 +27,18 @@ class Profile:
                                 value, "%Y-%m-%d"
                             ).date()
                     case "schedule-calendar-url":
-                        user_workspace.schedule_calendar_url = (
-                            value if len(value) > 1 else None
-                        )
+                        schedule_calendar_url = value if len(value) > 1 else None
+                        if (
+                            schedule_calendar_url
+                            != user_workspace.schedule_calendar_url
+                        ):
+                            user_workspace.schedule_calendar_url = schedule_calendar_url
+                            cal_sync.reset_calendar_validators(user_workspace)
 
-                cal_sync = CalendarSync()
                 user = cal_sync.update_user(user, 0)
 
+        ReferenceCache.prefetch(
+            [uw.workspace for uw in user.workspaces], "organization"
+        )
+
         return render_template("profile.html.j2", user=user, toggl_api_class=TogglApi)
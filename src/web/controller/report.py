@@ -1,31 +1,75 @@
 from flask import Response, session, render_template
 from datetime import date
 
-from src.db.entity import User, Workspace
+from src.db.entity import User, UserWorkspace, Workspace
+from src.db.reference_cache import ReferenceCache
 from src.schedule import Resolver, Heatmap
+from src.columnar import ColumnarResolver
+from src.util.lru_cache import LruCache
 
 
 class Report:
+    def __init__(
+        self,
+        engine: str = Resolver.ENGINE_AGGREGATION,
+        cache_size: int = 128,
+        cache_ttl: int = 900,
+    ) -> None:
+        self.engine = engine
+        self.cache = LruCache(cache_size, cache_ttl)
+
     def detailed(self, workspace_id: int) -> Response | str:
         user = User.objects.get(user_id=session["user_id"])
+        ReferenceCache.prefetch(user.workspaces, "workspace")
 
-        workspace = Workspace.objects.get(workspace_id=workspace_id)
+        workspace = ReferenceCache.get(Workspace, workspace_id)
         user_workspace = user.workspaces.get(workspace=workspace)
 
-        report = Resolver.create_report(
-            user, workspace, user_workspace.start_of_aggregation, date.today()
-        )
+        cache_key = self.__get_cache_key("detailed", user, user_workspace)
+        report = self.cache.get(cache_key)
+        if report is None:
+            report = ColumnarResolver.create_report(
+                user,
+                workspace,
+                user_workspace.start_of_aggregation,
+                date.today(),
+                self.engine,
+            )
+            self.cache.put(cache_key, report)
+        ReferenceCache.prefetch([report.workspace], "organization")
 
         return render_template("detailed_report.html.j2", user=user, report=report)
 
     def stats(self, workspace_id: int) -> Response | str:
         user = User.objects.get(user_id=session["user_id"])
+        ReferenceCache.prefetch(user.workspaces, "workspace")
 
-        workspace = Workspace.objects.get(workspace_id=workspace_id)
+        workspace = ReferenceCache.get(Workspace, workspace_id)
         user_workspace = user.workspaces.get(workspace=workspace)
 
-        heatmap, times = Heatmap.create_report(
-            user, workspace, user_workspace.start_of_aggregation, date.today()
-        )
+        cache_key = self.__get_cache_key("stats", user, user_workspace)
+        heatmap_report = self.cache.get(cache_key)
+        if heatmap_report is None:
+            # prefer the stored heatmap, it is only missing after setting changes
+            heatmap_report = Heatmap.load_report(user, workspace)
+            if heatmap_report is None:
+                heatmap_report = Heatmap.create_report(
+                    user, workspace, user_workspace.start_of_aggregation, date.today()
+                )
+            self.cache.put(cache_key, heatmap_report)
+        heatmap, times = heatmap_report
 
         return render_template("stats.html.j2", user=user, heatmap=heatmap, times=times)
+
+    def __get_cache_key(
+        self, report_type: str, user: User, user_workspace: UserWorkspace
+    ) -> tuple:
+        return (
+            report_type,
+            user.user_id,
+            user_workspace.workspace.workspace_id,
+            user.timezone,
+            user_workspace.start_of_aggregation,
+            date.today(),
+            user_workspace.data_version,
+        )
@@ -7,6 +7,7 @@ from datetime import datetime, timezone
 
 from src.toggl.model import TagData, ClientData, ProjectData, TimeEntryData
 from src.db.entity import User, Tag, Client, Project, TimeEntry
+from src.db.reference_cache import ReferenceCache
 
 
 class Webhook:
@@ -23,7 +24,10 @@ class Webhook:
         # Check if user workspace could be found
         user_workspace = None
         for u_workspace in user.workspaces:
-            if u_workspace.workspace.workspace_id == workspace_id:
+            if (
+                ReferenceCache.get_reference_id(u_workspace, "workspace")
+                == workspace_id
+            ):
                 user_workspace = u_workspace
                 break
         if user_workspace is None:
@@ -113,4 +117,7 @@ class Webhook:
                         elif event["metadata"]["action"] == "deleted":
                             TimeEntry.delete_via_id(time_entry_data.id)
 
+                # invalidate cached reports
+                User.bump_data_version(workspace_id, user.user_id)
+
         return response, 200
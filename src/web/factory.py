@@ -13,7 +13,13 @@ from src.web import controller, template_filter
 class FlaskFactory:
     @classmethod
     def create_app(
-        cls, session_secret: str, root_dir: str, server_url: str = None
+        cls,
+        session_secret: str,
+        root_dir: str,
+        server_url: str = None,
+        report_engine: str = "aggregation",
+        report_cache_size: int = 128,
+        report_cache_ttl: int = 900,
     ) -> Flask:
         app = Flask(
             __name__,
@@ -35,7 +41,9 @@ class FlaskFactory:
         webhook_logger = Log.get_logger("webhook")
         webhook_controller = controller.Webhook(webhook_logger)
         profile_controller = controller.Profile()
-        report_controller = controller.Report()
+        report_controller = controller.Report(
+            report_engine, report_cache_size, report_cache_ttl
+        )
 
         # Add routes
         @app.route("/")
@@ -0,0 +1,50 @@
+import unittest
+
+import httpx
+
+from src.toggl.rate_limit import RateLimiter
+
+
+class RateLimiterTest(unittest.TestCase):
+    @classmethod
+    def response(cls, remaining: int, resets_in: int) -> httpx.Response:
+        return httpx.Response(
+            200,
+            headers={
+                RateLimiter.QUOTA_REMAINING_HEADER: str(remaining),
+                RateLimiter.QUOTA_RESETS_IN_HEADER: str(resets_in),
+            },
+        )
+
+    def test_large_quota_does_not_slow_down(self):
+        rate_limiter = RateLimiter()
+        rate_limiter.update(self.response(600, 3600))
+
+        waits = [rate_limiter.reserve() for _ in range(5)]
+
+        for i, wait in enumerate(waits):
+            self.assertLessEqual(wait, i / RateLimiter.SAFE_RATE + 0.1)
+
+    def test_low_quota_spreads_remaining_requests(self):
+        rate_limiter = RateLimiter()
+        rate_limiter.update(self.response(10, 100))
+
+        waits = [rate_limiter.reserve() for _ in range(3)]
+
+        # 10 requests in 100 seconds
+        self.assertGreater(waits[2], 19)
+
+    def test_exhausted_quota_blocks_until_reset(self):
+        rate_limiter = RateLimiter()
+        retry_after = rate_limiter.update(
+            httpx.Response(
+                402,
+                headers={
+                    RateLimiter.QUOTA_REMAINING_HEADER: "0",
+                    RateLimiter.QUOTA_RESETS_IN_HEADER: "30",
+                },
+            )
+        )
+
+        self.assertEqual(retry_after, 30)
+        self.assertGreater(rate_limiter.reserve(), 29)
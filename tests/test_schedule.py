@@ -0,0 +1,76 @@
+import contextlib
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from src.db.entity import UserWorkspace
+from src.schedule import CalendarSync
+
+CALENDAR_URL = "https://calendar.example.com/calendar.ics"
+CALENDAR = (
+    b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:test\r\n"
+    b"BEGIN:VEVENT\r\nUID:1\r\nDTSTART;VALUE=DATE:20240101\r\n"
+    b"DESCRIPTION:ttc-schedule:target=480\r\nEND:VEVENT\r\n"
+    b"END:VCALENDAR\r\n"
+)
+
+
+class CalendarSyncTest(unittest.TestCase):
+    @classmethod
+    def fake_stream(cls, status_code: int, content: bytes, etag: str):
+        @contextlib.contextmanager
+        def stream(method: str, url: str, **kwargs):
+            yield httpx.Response(
+                status_code,
+                headers={"ETag": etag},
+                content=content,
+                request=httpx.Request(method, url),
+            )
+
+        return stream
+
+    @classmethod
+    def create_user_workspace(cls) -> UserWorkspace:
+        return UserWorkspace(
+            schedule_calendar_url=CALENDAR_URL,
+            schedule_calendar_etag='"old"',
+            schedule_calendar_hash="old",
+        )
+
+    def test_fetch_calendar_stores_validators(self):
+        user_workspace = self.create_user_workspace()
+
+        with patch(
+            "src.schedule.httpx.stream", self.fake_stream(200, CALENDAR, '"new"')
+        ):
+            ical = CalendarSync().fetch_calendar(user_workspace)
+
+        self.assertEqual(len(CalendarSync().filter_ical_components(ical)), 1)
+        self.assertEqual(user_workspace.schedule_calendar_etag, '"new"')
+        self.assertNotEqual(user_workspace.schedule_calendar_hash, "old")
+
+    def test_fetch_calendar_keeps_validators_if_parsing_fails(self):
+        user_workspace = self.create_user_workspace()
+
+        with patch(
+            "src.schedule.httpx.stream",
+            self.fake_stream(200, b"<html>not a calendar</html>", '"new"'),
+        ):
+            with self.assertRaises(ValueError):
+                CalendarSync().fetch_calendar(user_workspace)
+
+        self.assertEqual(user_workspace.schedule_calendar_etag, '"old"')
+        self.assertEqual(user_workspace.schedule_calendar_hash, "old")
+
+    def test_fetch_calendar_rejects_error_responses(self):
+        user_workspace = self.create_user_workspace()
+
+        with patch(
+            "src.schedule.httpx.stream", self.fake_stream(404, CALENDAR, '"new"')
+        ):
+            with self.assertRaises(httpx.HTTPStatusError):
+                CalendarSync().fetch_calendar(user_workspace)
+
+        self.assertEqual(user_workspace.schedule_calendar_etag, '"old"')
+        self.assertEqual(user_workspace.schedule_calendar_hash, "old")
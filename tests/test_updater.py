@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+from src.updater import Updater
+
+
+class FakeAsyncTogglApi:
+    MIN_YEAR = 2024
+
+    def __init__(self, **kwargs) -> None:
+        pass
+
+    async def __aenter__(self) -> "FakeAsyncTogglApi":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        pass
+
+    async def get_workspace_subscriptions(self, workspace_id: int) -> list:
+        return []
+
+    async def get_workspace_clients(self, workspace_id: int) -> list:
+        return []
+
+    async def get_workspace_projects(self, workspace_id: int) -> list:
+        return []
+
+    async def get_workspace_tags(self, workspace_id: int) -> list:
+        return []
+
+    async def iter_workspace_time_entry_report_start_end(
+        self, workspace_id: int, start_date, end_date
+    ):
+        # more pages than fit into the queue
+        for _ in range(100):
+            yield []
+
+
+class UpdaterTest(unittest.TestCase):
+    def test_fetch_workspace_datasets_raises_store_error(self):
+        updater = Updater(60, 60, Flask(__name__), "test")
+
+        def store(time_entry_report_dataset, workspace_id):
+            raise RuntimeError("bulk write failed")
+
+        with (
+            patch("src.updater.AsyncTogglApi", FakeAsyncTogglApi),
+            patch(
+                "src.updater.TimeEntry.bulk_create_or_update_via_report_api_data",
+                store,
+            ),
+        ):
+            with self.assertRaisesRegex(RuntimeError, "bulk write failed"):
+                asyncio.run(
+                    asyncio.wait_for(
+                        updater.fetch_workspace_datasets("token", [1], None, {1}),
+                        timeout=5,
+                    )
+                )
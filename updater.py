@@ -19,6 +19,7 @@ def main():
     config = Config(path.join(script_dir, ".env"))
     logger.setLevel(config.log_level)
     Database.connect(config.database_uri)
+    Database.ensure_indexes()
 
     web_app = FlaskFactory.create_app(
         config.flask_session_secret,
@@ -30,6 +31,8 @@ def main():
         config.sync_interval_toggl,
         web_app,
         config.server_id,
+        config.toggl_max_concurrent_requests,
+        config.full_sync_interval_toggl,
     )
     updater.run()
 
@@ -18,8 +18,15 @@ def main() -> None:
     config = Config(path.join(script_dir, ".env"))
     logger.setLevel(config.log_level)
     Database.connect(config.database_uri)
-
-    app = FlaskFactory.create_app(config.flask_session_secret, script_dir)
+    Database.ensure_indexes()
+
+    app = FlaskFactory.create_app(
+        config.flask_session_secret,
+        script_dir,
+        report_engine=config.report_engine,
+        report_cache_size=config.report_cache_size,
+        report_cache_ttl=config.report_cache_ttl,
+    )
     app.run(debug=True, use_reloader=False, host="0.0.0.0")
 
     Database.disconnect()
@@ -18,8 +18,15 @@ logger.setLevel(config.log_level)
 
 def start() -> Flask:
     Database.connect(config.database_uri)
-
-    app = FlaskFactory.create_app(config.flask_session_secret, script_dir)
+    Database.ensure_indexes()
+
+    app = FlaskFactory.create_app(
+        config.flask_session_secret,
+        script_dir,
+        report_engine=config.report_engine,
+        report_cache_size=config.report_cache_size,
+        report_cache_ttl=config.report_cache_ttl,
+    )
 
     return app
 